@@ -1,10 +1,35 @@
-from ._pim import MongoClient
-from .mongod import Mongod
-from .downloader import download
+import importlib
 
+# Exports are imported on first access. The pytest plugin is loaded in every project
+# the package is installed in, and importing the daemon modules installs a SIGTERM
+# handler.
+_EXPORTS = {
+    "AsyncMongoClient": "._async",
+    "AsyncMongod": "._async",
+    "BrokerClient": ".server",
+    "download": ".downloader",
+    "MongoClient": "._pim",
+    "Mongod": ".mongod",
+    "MongodPool": ".pool",
+    "OplogUndo": ".undo",
+    "ReplicaSet": ".replset",
+    "ShardedCluster": ".cluster",
+    "start_many": ".mongod",
+    "stop_many": ".mongod",
+    "TemplateCache": ".templates",
+    "TemplateDatabase": ".templates",
+}
 
-__all__ = [
-    "download",
-    "MongoClient",
-    "Mongod",
-]
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    try:
+        module = _EXPORTS[name]
+    except KeyError:
+        raise AttributeError(
+            "module {!r} has no attribute {!r}".format(__name__, name)
+        ) from None
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
@@ -0,0 +1,138 @@
+import asyncio
+import logging
+
+from ._profiles import CONSTRAINED_PROFILE
+from ._utils import async_wait_for_exit
+from .context import Context
+from .mongod import Mongod, _READY_POLL_MAX, _READY_POLL_MIN
+
+try:
+    from pymongo import AsyncMongoClient as _AsyncMongoClient
+except ImportError:  # pymongo < 4.10
+    _AsyncMongoClient = None
+
+logger = logging.getLogger("PYMONGOIM_ASYNC")
+
+
+class AsyncMongod(Mongod):
+    """`Mongod` with awaitable `start` and `stop`, to be used with `async with`.
+
+    Waiting for the daemon to get ready or to exit is done on the event loop, and
+    blocking steps, like downloading the binary or cleaning the data folder, run in
+    the default executor. Many instances can start concurrently from one event loop:
+    ::
+        mongods = [AsyncMongod(context) for _ in range(4)]
+        await asyncio.gather(*(md.start() for md in mongods))
+    """
+
+    def __init__(self, pim_context: Context = None, template=None):
+        super().__init__(pim_context, template)
+        if self._persistent is not None:
+            raise ValueError("AsyncMongod doesn't support persistent mode.")
+
+    def __enter__(self):
+        raise TypeError("Use AsyncMongod with `async with`.")
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.stop()
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        started_at = await loop.run_in_executor(None, self._spawn)
+        try:
+            await self._async_wait_until_ready(started_at)
+        finally:
+            self.config.release_port()
+        self._started(started_at)
+
+    async def stop(self, clean_up=True):
+        loop = asyncio.get_running_loop()
+        if self.config.profile == CONSTRAINED_PROFILE and self.is_running:
+            await loop.run_in_executor(None, self._report_cache)
+        # Before the daemon is gone, see `Mongod.stop`.
+        await loop.run_in_executor(None, self._close_client)
+        if self.is_running:
+            await loop.run_in_executor(None, self._request_shutdown)
+            timeout = self._pim_context.mongod_shutdown_timeout
+            if await async_wait_for_exit(self._proc, timeout) is None:
+                await loop.run_in_executor(None, self._kill, timeout)
+            logger.info("Stopped mongod.")
+        if clean_up:
+            await loop.run_in_executor(None, self._clean_up)
+
+    async def mongodump(self, database, collection):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, super().mongodump, database, collection
+        )
+
+    async def _async_wait_until_ready(self, started_at):
+        "Same as `Mongod._wait_until_ready`, without blocking the event loop"
+        loop = asyncio.get_running_loop()
+        watcher = self._log_watcher
+        delay = _READY_POLL_MIN
+        while True:
+            if self._check_startup(watcher, started_at):
+                return
+            if delay >= _READY_POLL_MAX and await loop.run_in_executor(
+                None, lambda: self.is_healthy
+            ):
+                return
+            await async_wait_for_exit(self._proc, delay)
+            delay = min(delay * 2, _READY_POLL_MAX)
+
+
+if _AsyncMongoClient is None:
+
+    class AsyncMongoClient:
+        def __init__(self, *args, **kwargs):
+            raise ImportError("AsyncMongoClient needs pymongo 4.10 or later.")
+
+else:
+
+    class AsyncMongoClient(_AsyncMongoClient):
+        """Wraps `pymongo.AsyncMongoClient` with an ephemeral MongoDB server.
+
+        The server is started by `async with`, `aconnect` or the first operation,
+        whichever comes first, since constructors can't be awaited.
+        """
+
+        def __init__(self, host=None, port=None, **kwargs):
+            self._pim_context: Context = Context()
+            if port is not None:
+                self._pim_context.mongod_port = port
+            if host is not None:
+                self._pim_context.mongo_client_host = host
+            self._mongod = AsyncMongod(self._pim_context)
+            # Created on first use, to bind it to the running event loop.
+            self._pim_start_lock = None
+            super().__init__(self._mongod.connection_string, **kwargs)
+
+        async def __aenter__(self):
+            await self._pim_ensure_running()
+            return await super().__aenter__()
+
+        async def close(self):
+            await super().close()
+            await self._mongod.stop()
+
+        async def pim_mongodump(self, *args, **kwargs):
+            await self._pim_ensure_running()
+            return await self._mongod.mongodump(*args, **kwargs)
+
+        async def _get_topology(self):
+            await self._pim_ensure_running()
+            return await super()._get_topology()
+
+        async def _pim_ensure_running(self):
+            if self._mongod.is_running:
+                return
+            if self._pim_start_lock is None:
+                self._pim_start_lock = asyncio.Lock()
+            async with self._pim_start_lock:
+                if not self._mongod.is_running:
+                    await self._mongod.start()
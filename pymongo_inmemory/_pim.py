@@ -1,7 +1,53 @@
+import contextlib
+import logging
+import threading
+import time
+
 import pymongo
+from pymongo import monitoring
 
-from .mongod import Mongod
+from .cluster import ShardedCluster
+from .mongod import Mongod, client_options
 from .context import Context
+from .replset import ReplicaSet
+
+logger = logging.getLogger("PYMONGOIM_CLIENT")
+
+
+class _ActivityListener(monitoring.CommandListener):
+    """Keeps track of commands in flight and when the last one was seen."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._last_seen = time.monotonic()
+
+    def touch(self):
+        with self._lock:
+            self._last_seen = time.monotonic()
+
+    def idle_for(self):
+        "Seconds since the last command finished, 0 if there are commands in flight"
+        with self._lock:
+            if self._in_flight > 0:
+                return 0
+            return time.monotonic() - self._last_seen
+
+    def started(self, event):
+        with self._lock:
+            self._in_flight += 1
+            self._last_seen = time.monotonic()
+
+    def succeeded(self, event):
+        self._finished()
+
+    def failed(self, event):
+        self._finished()
+
+    def _finished(self):
+        with self._lock:
+            self._in_flight = max(self._in_flight - 1, 0)
+            self._last_seen = time.monotonic()
 
 
 class MongoClient(pymongo.MongoClient):
@@ -11,21 +57,146 @@ class MongoClient(pymongo.MongoClient):
             self._pim_context.mongod_port = port
         if host is not None:
             self._pim_context.mongo_client_host = host
-        self._mongod = Mongod(self._pim_context)
-        self._mongod.start()
+        if self._pim_context.cluster_shards > 0:
+            self._mongod = ShardedCluster(self._pim_context)
+        elif self._pim_context.replica_set_members > 0:
+            self._mongod = ReplicaSet(self._pim_context)
+        else:
+            self._mongod = Mongod(self._pim_context)
+
+        # Session operations without one of their own join, see `pim_isolated`.
+        self._pim_session = None
+        self._pim_lock = threading.RLock()
+        self._pim_closed = threading.Event()
+        self._pim_activity = _ActivityListener()
+        kwargs["event_listeners"] = list(kwargs.get("event_listeners") or []) + [
+            self._pim_activity
+        ]
+        # Replica sets and clusters have no `reset`.
+        write_tracker = getattr(self._mongod, "write_tracker", None)
+        if write_tracker is not None:
+            kwargs["event_listeners"].append(write_tracker)
+
+        for option, value in client_options(self._pim_context).items():
+            kwargs.setdefault(option, value)
+
+        if self._pim_context.lazy_start:
+            logger.info("Lazy start, mongod will start on the first operation.")
+            kwargs.setdefault("connect", False)
+        else:
+            self._mongod.start()
         super().__init__(self._mongod.connection_string, **kwargs)
+        # One connection pool for the daemon, its health checks use this client too.
+        attach_client = getattr(self._mongod, "attach_client", None)
+        if attach_client is not None:
+            attach_client(self)
+
+        if self._pim_context.idle_timeout is not None:
+            threading.Thread(
+                target=self._pim_watch_idle, name="pymongoim-idle", daemon=True
+            ).start()
 
     def close(self):
-        super().close()
-        self._mongod.stop()
+        self._pim_closed.set()
+        with self._pim_lock:
+            # Client first, closing it ends its sessions on the daemon, which waits
+            # for the server selection timeout once the daemon is gone.
+            super().close()
+            detach_client = getattr(self._mongod, "detach_client", None)
+            if detach_client is not None:
+                detach_client()
+            self._mongod.stop()
+
+    @contextlib.contextmanager
+    def pim_isolated(self):
+        """Run the block in a transaction that is aborted at the end, rolling back
+        its writes. Operations without an explicit session join the transaction.
+        Transactions need a replica set, see `replica_set_members`.
+
+        The session is shared by the client, so it isn't meant for concurrent use.
+        """
+        if self._pim_context.replica_set_members < 1 and (
+            self._pim_context.cluster_shards < 1
+        ):
+            raise RuntimeError(
+                "Transactions need a replica set, set replica_set_members to 1 or more."
+            )
+        if self._pim_session is not None:
+            raise RuntimeError("Already running in an isolated transaction.")
+
+        with self.start_session() as session:
+            session.start_transaction()
+            self._pim_session = session
+            try:
+                yield session
+            finally:
+                self._pim_session = None
+                if session.in_transaction:
+                    session.abort_transaction()
+
+    def pim_reset(self, keep_indexes=False):
+        "See `Mongod.reset`, not available for replica sets and clusters"
+        if not hasattr(self._mongod, "reset"):
+            raise RuntimeError(
+                "Reset needs a single mongod, use pim_isolated or OplogUndo with "
+                "replica_set_members or cluster_shards."
+            )
+        self._pim_ensure_running()
+        self._mongod.reset(keep_indexes)
 
     def pim_mongodump(self, *args, **kwargs):
+        self._pim_ensure_running()
         return self._mongod.mongodump(*args, **kwargs)
 
+    def _get_topology(self):
+        # Every operation goes through here first, which makes it the place to start
+        # a lazy or idle stopped mongod.
+        self._pim_ensure_running()
+        return super()._get_topology()
 
-if __name__ == "__main__":
-    import logging
+    @contextlib.contextmanager
+    def _tmp_session(self, session, *args, **kwargs):
+        # Operations lend a temporary session from here, unless one is given.
+        if session is None and self._pim_session is not None:
+            yield self._pim_session
+            return
+        with super()._tmp_session(session, *args, **kwargs) as tmp_session:
+            yield tmp_session
+
+    def _ensure_session(self, session=None):
+        # Cursors get their implicit session from here.
+        if session is None and self._pim_session is not None:
+            return self._pim_session
+        return super()._ensure_session(session)
+
+    def _pim_ensure_running(self):
+        # Under the lock, so that the idle watcher either sees the activity, or has
+        # stopped mongod before the check. Never in between.
+        with self._pim_lock:
+            self._pim_activity.touch()
+            if not self._pim_closed.is_set() and not self._mongod.is_running:
+                self._mongod.start()
 
+    def _pim_watch_idle(self):
+        timeout = self._pim_context.idle_timeout
+        while True:
+            idle_for = self._pim_activity.idle_for()
+            if idle_for >= timeout:
+                with self._pim_lock:
+                    if self._pim_closed.is_set():
+                        return
+                    idle_for = self._pim_activity.idle_for()
+                    if idle_for >= timeout and self._mongod.is_running:
+                        logger.info(
+                            "No commands for {} secs, stopping mongod.".format(timeout)
+                        )
+                        self._mongod.stop(clean_up=False)
+                idle_for = 0
+            if self._pim_closed.wait(timeout - idle_for):
+                return
+
+
+if __name__ == "__main__":
     logging.basicConfig(level=logging.DEBUG)
     m = MongoClient("mongodb://127.0.0.1/something", 27017)
     m.close()
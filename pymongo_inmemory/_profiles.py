@@ -0,0 +1,170 @@
+"""Launch profiles for mongod
+
+A profile is a named set of startup options. Every option records the MongoDB
+versions and storage engine it is valid for, so that only options the selected mongod
+understands end up in the boot command.
+"""
+from collections import namedtuple
+import logging
+import shlex
+
+from ._utils import make_semver
+
+logger = logging.getLogger("PYMONGOIM_PROFILES")
+
+# `parameter` options go to `--setParameter name=value`, the rest are command line
+# options. Versions are inclusive (major, minor) tuples, `None` means unbounded.
+Flag = namedtuple(
+    "Flag", ["name", "value", "parameter", "min_version", "max_version", "engine"]
+)
+Profile = namedtuple("Profile", ["engine", "flags"])
+
+# Profile whose resources are fixed, auto sizing is left out, and whose cache usage
+# is reported at shutdown.
+CONSTRAINED_PROFILE = "constrained"
+
+
+def _option(name, value=None, min_version=None, max_version=None, engine=None):
+    return Flag(name, value, False, min_version, max_version, engine)
+
+
+def _parameter(name, value, min_version=None, max_version=None, engine=None):
+    return Flag(name, value, True, min_version, max_version, engine)
+
+
+PROFILES = {
+    # No options, mongod defaults.
+    "default": Profile(None, []),
+    # Cheap startup and low latency for throwaway test data.
+    "fast-test": Profile(
+        None,
+        [
+            _option("--wiredTigerCacheSizeGB", "0.25", (3, 4), engine="wiredTiger"),
+            _option(
+                "--wiredTigerCollectionBlockCompressor",
+                "none",
+                (3, 0),
+                engine="wiredTiger",
+            ),
+            _option(
+                "--wiredTigerJournalCompressor", "none", (3, 0), engine="wiredTiger"
+            ),
+            _option("--syncdelay", "3600"),
+            _parameter("diagnosticDataCollectionEnabled", "false", (3, 2)),
+            _parameter("ttlMonitorEnabled", "false"),
+            _parameter("disableLogicalSessionCacheRefresh", "true", (3, 6)),
+        ],
+    ),
+    # Production storage engine without background jobs that add noise to timings.
+    # Diagnostic data collection stays on, to be able to look into the results.
+    "benchmark": Profile(
+        "wiredTiger",
+        [
+            _parameter("ttlMonitorEnabled", "false"),
+            _parameter("disableLogicalSessionCacheRefresh", "true", (3, 6)),
+        ],
+    ),
+    # Production storage engine with mongod defaults.
+    "production-like": Profile("wiredTiger", []),
+    # Cache far smaller than any working set, to reproduce eviction locally. Below
+    # the 0.25 GB floor of --wiredTigerCacheSizeGB, so set on the engine itself.
+    CONSTRAINED_PROFILE: Profile(
+        "wiredTiger",
+        [
+            _option(
+                "--wiredTigerEngineConfigString",
+                "cache_size=32M",
+                (3, 0),
+                engine="wiredTiger",
+            ),
+            _option("--maxConns", "32"),
+        ],
+    ),
+    # Nothing but `mongod_extra_args`.
+    "custom": Profile(None, []),
+}
+
+
+def get_profile(name):
+    try:
+        return PROFILES[name]
+    except KeyError:
+        raise ValueError(
+            "Unknown mongod profile {}, use one of {}.".format(
+                name, ", ".join(PROFILES)
+            )
+        )
+
+
+def _is_supported(flag, version, engine):
+    if flag.engine is not None and flag.engine != engine:
+        return False
+    if version.major is None:
+        # Unknown version, e.g. a local mongod, let mongod decide.
+        return True
+    current = (version.major, version.minor or 0)
+    if flag.min_version is not None and current < flag.min_version:
+        return False
+    if flag.max_version is not None and current > flag.max_version:
+        return False
+    return True
+
+
+def _overridden(extra_args):
+    "Option and parameter names set in `extra_args`"
+    options, parameters = set(), set()
+    for index, arg in enumerate(extra_args):
+        if arg == "--setParameter" and index + 1 < len(extra_args):
+            parameters.add(extra_args[index + 1].split("=", 1)[0])
+        elif arg.startswith("--"):
+            options.add(arg.split("=", 1)[0])
+    return options, parameters
+
+
+def cache_size_gb(profile_name):
+    "WiredTiger cache size the profile sets, `None` if it leaves mongod's default"
+    for flag in get_profile(profile_name).flags:
+        if flag.name == "--wiredTigerCacheSizeGB":
+            return float(flag.value)
+    return None
+
+
+def launch_args(
+    profile_name, version=None, engine=None, extra_args=None, overrides=()
+):
+    """Command line arguments for mongod of `version` running `engine`.
+
+    Options not supported by the version or the engine are left out. `overrides`,
+    flags like the profile's, replace profile flags of the same name. Options given
+    in `extra_args`, a string parsed like a shell would, win over both.
+
+    Returns
+    -------
+    list of str
+    """
+    profile = get_profile(profile_name)
+    extra_args = shlex.split(extra_args) if extra_args else []
+    semver = make_semver(version)
+    overridden_options, overridden_parameters = _overridden(extra_args)
+
+    overrides = list(overrides)
+    replaced = {flag.name for flag in overrides}
+    flags = overrides + [flag for flag in profile.flags if flag.name not in replaced]
+
+    args = []
+    for flag in flags:
+        if not _is_supported(flag, semver, engine):
+            logger.info(
+                "Skipping {} of profile {}, it isn't supported by {} {}.".format(
+                    flag.name, profile_name, version, engine
+                )
+            )
+            continue
+        if flag.parameter:
+            if flag.name not in overridden_parameters:
+                args += ["--setParameter", "{}={}".format(flag.name, flag.value)]
+        elif flag.name not in overridden_options:
+            args.append(flag.name)
+            if flag.value is not None:
+                args.append(flag.value)
+    return args + extra_args
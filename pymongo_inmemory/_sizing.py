@@ -0,0 +1,111 @@
+"""Resource limits of mongod derived from the host
+
+By default every mongod sizes its WiredTiger cache to about half of the RAM, as if it
+had the host to itself. With many daemons on one host that overcommits memory, so
+auto sizing splits the memory, connections and file handles evenly between the
+daemons expected on it.
+"""
+from collections import namedtuple
+import logging
+import os
+
+from ._profiles import _option
+
+logger = logging.getLogger("PYMONGOIM_SIZING")
+
+Sizing = namedtuple("Sizing", ["cache_gb", "max_conns", "max_files"])
+
+_GB = 1024 ** 3
+# Floor of WiredTiger.
+_MIN_CACHE_GB = 0.25
+# Memory left to the rest of the host, mongod's default leaves 1 GB too.
+_RESERVED_MEMORY = 1 * _GB
+_CONNS_PER_CPU = 100
+_MIN_CONNS = 64
+_MAX_CONNS = 65536
+# Data files, journal and log of a daemon, on top of a handle per connection.
+_DATA_FILE_HANDLES = 1024
+
+_CGROUP_MEMORY_LIMITS = (
+    "/sys/fs/cgroup/memory.max",
+    "/sys/fs/cgroup/memory/memory.limit_in_bytes",
+)
+
+
+def total_memory():
+    """Bytes of memory available to this process, the cgroup limit of a container if
+    it is lower than the physical memory. `None` if it can't be determined.
+    """
+    try:
+        memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return None
+    for limit_path in _CGROUP_MEMORY_LIMITS:
+        try:
+            with open(limit_path) as f:
+                limit = f.read().strip()
+        except OSError:
+            continue
+        if limit.isdigit():
+            memory = min(memory, int(limit))
+    return memory
+
+
+def cpu_count():
+    "CPUs this process can run on"
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def compute(instances, memory=None, cpus=None, max_cache_gb=None):
+    """Share of the host for each of `instances` daemons. The cache is capped at
+    `max_cache_gb`, if given.
+
+    Returns
+    -------
+    Sizing: `cache_gb` is `None` if the memory is unknown.
+    """
+    memory = total_memory() if memory is None else memory
+    cpus = cpu_count() if cpus is None else cpus
+    instances = max(instances, 1)
+
+    cache_gb = None
+    if memory is not None:
+        # Half of the memory for caches, like mongod's default, split evenly.
+        share = max(memory - _RESERVED_MEMORY, 0) / 2 / instances / _GB
+        cache_gb = max(_MIN_CACHE_GB, round(share, 2))
+        if max_cache_gb is not None:
+            cache_gb = min(cache_gb, max_cache_gb)
+    max_conns = max(_MIN_CONNS, min(_MAX_CONNS, cpus * _CONNS_PER_CPU // instances))
+    return Sizing(cache_gb, max_conns, max_conns + _DATA_FILE_HANDLES)
+
+
+def flags(sizing):
+    "Launch options of `sizing`, in the form of profile flags"
+    result = [_option("--maxConns", str(sizing.max_conns))]
+    if sizing.cache_gb is not None:
+        result.append(
+            _option(
+                "--wiredTigerCacheSizeGB",
+                str(sizing.cache_gb),
+                min_version=(3, 4),
+                engine="wiredTiger",
+            )
+        )
+    return result
+
+
+def raise_file_limit(max_files):
+    """Raise the soft limit of open files of this process, which daemons inherit, to
+    `max_files`, as far as the hard limit allows. It is never lowered.
+    """
+    try:
+        import resource
+    except ImportError:  # Windows
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    target = max_files if hard == resource.RLIM_INFINITY else min(max_files, hard)
+    if soft != resource.RLIM_INFINITY and soft < target:
+        logger.info("Raising open files limit from {} to {}".format(soft, target))
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
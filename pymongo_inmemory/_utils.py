@@ -1,6 +1,14 @@
+import asyncio
 from collections import namedtuple
+from contextlib import contextmanager
 import logging
+import random
+import select
+import shutil
 import socket
+import subprocess
+import sys
+import threading
 import os
 from os import path
 
@@ -8,12 +16,73 @@ logger = logging.getLogger("PYMONGOIM_UTILS")
 
 SemVer = namedtuple("SemVer", ["major", "minor", "patch"])
 
+# On Linux a bound, non-listening socket with SO_REUSEADDR doesn't stop mongod from
+# binding the same port, so a reservation can be held until mongod is up. On other
+# platforms the reservation has to be released right before spawning mongod.
+RESERVATION_SURVIVES_BIND = sys.platform.startswith("linux")
 
-def find_open_port(sq):
-    for port in sq:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as soc:
-            if 0 != soc.connect_ex(("localhost", port)):
-                return port
+_reserved_ports = set()
+_reserved_ports_lock = threading.Lock()
+
+
+class PortReservation:
+    """A port that is bound by this process, so that neither the kernel nor another
+    process hands it out, until `release` is called.
+    """
+
+    def __init__(self, port, soc):
+        self.port = port
+        self._socket = soc
+
+    def release(self):
+        if self._socket is None:
+            return
+        self._socket.close()
+        self._socket = None
+        with _reserved_ports_lock:
+            _reserved_ports.discard(self.port)
+
+
+def reserve_port(port_range=None, host="127.0.0.1"):
+    """Reserve a free port. If no `port_range` is given the kernel picks an ephemeral
+    port, otherwise ports in the range are tried starting from a random offset, to
+    lower the chance of parallel workers competing for the same ports.
+
+    Binding is the availability check, so there is no window between finding a free
+    port and claiming it.
+
+    Returns
+    -------
+    PortReservation: Holds the port until released.
+    """
+    if port_range is None:
+        candidates = [0]
+    else:
+        offset = random.randrange(len(port_range)) if len(port_range) else 0
+        candidates = list(port_range[offset:]) + list(port_range[:offset])
+
+    for candidate in candidates:
+        soc = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            # Bind without SO_REUSEADDR so that ports held by other reservations are
+            # skipped, then set it so that mongod can still bind the port.
+            soc.bind((host, candidate))
+            if RESERVATION_SURVIVES_BIND:
+                soc.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        except OSError:
+            soc.close()
+            continue
+
+        port = soc.getsockname()[1]
+        with _reserved_ports_lock:
+            if port in _reserved_ports:
+                soc.close()
+                continue
+            _reserved_ports.add(port)
+        logger.debug("Reserved port {}".format(port))
+        return PortReservation(port, soc)
+
+    raise RuntimeError("Can't find an open port in {}".format(port_range))
 
 
 def make_semver(version=None):
@@ -44,3 +113,154 @@ def mkdir_ifnot_exist(*folders):
         if not path.isdir(current_path):
             os.mkdir(current_path)
     return current_path
+
+
+def wait_for_exit(proc, timeout):
+    """Wait up to `timeout` seconds for a `subprocess.Popen` process to exit.
+
+    On Linux the process is watched through a pidfd, so this returns as soon as the
+    process exits. Elsewhere it falls back to `Popen.wait`.
+
+    Returns
+    -------
+    int or None: Exit code of the process, `None` if it is still running.
+    """
+    if proc.poll() is not None:
+        return proc.returncode
+
+    pidfd = None
+    if hasattr(os, "pidfd_open"):
+        try:
+            pidfd = os.pidfd_open(proc.pid)
+        except OSError:
+            # Kernel doesn't support pidfds, or the process is already gone.
+            pidfd = None
+
+    if pidfd is not None:
+        try:
+            poller = select.poll()
+            poller.register(pidfd, select.POLLIN)
+            poller.poll(timeout * 1000)
+        finally:
+            os.close(pidfd)
+        return proc.poll()
+
+    try:
+        return proc.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return None
+
+
+async def async_wait_for_exit(proc, timeout):
+    """Awaitable version of `wait_for_exit`.
+
+    On Linux the event loop watches a pidfd of the process, elsewhere the process is
+    polled with `asyncio.sleep` in between.
+    """
+    if proc.poll() is not None:
+        return proc.returncode
+
+    loop = asyncio.get_running_loop()
+    pidfd = None
+    if hasattr(os, "pidfd_open"):
+        try:
+            pidfd = os.pidfd_open(proc.pid)
+        except OSError:
+            pidfd = None
+
+    if pidfd is not None:
+        exited = loop.create_future()
+        try:
+            loop.add_reader(pidfd, lambda: exited.done() or exited.set_result(None))
+        except NotImplementedError:
+            # Event loops without reader support, like the proactor loop.
+            os.close(pidfd)
+        else:
+            try:
+                await asyncio.wait_for(exited, timeout)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                loop.remove_reader(pidfd)
+                os.close(pidfd)
+            return proc.poll()
+
+    deadline = loop.time() + timeout
+    while proc.poll() is None and loop.time() < deadline:
+        await asyncio.sleep(min(0.05, max(deadline - loop.time(), 0)))
+    return proc.poll()
+
+
+# ioctl request to share the extents of a file with another, see ioctl_ficlone(2).
+_FICLONE = 0x40049409
+
+
+def _clone_file(src, dst):
+    if sys.platform.startswith("linux"):
+        import fcntl
+
+        try:
+            with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+                fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+        except OSError:
+            # Filesystem doesn't support reflinks, or src and dst are on different
+            # filesystems.
+            pass
+        else:
+            shutil.copystat(src, dst)
+            return dst
+    return shutil.copy2(src, dst)
+
+
+def clone_tree(src, dst, ignore=()):
+    """Copy the `src` folder into `dst`. Files are reflinked, which makes them
+    copy-on-write clones, where the filesystem supports it (Btrfs, XFS, ...) and
+    copied otherwise.
+
+    Parameters
+    ----------
+    ignore: list of str
+        Glob patterns of files and folders to skip.
+    """
+    return shutil.copytree(
+        src,
+        dst,
+        ignore=shutil.ignore_patterns(*ignore),
+        copy_function=_clone_file,
+        dirs_exist_ok=True,
+    )
+
+
+@contextmanager
+def file_lock(lock_path):
+    """Exclusive lock, across processes, held for the duration of the `with` block.
+
+    The lock is taken on `lock_path`, created if it doesn't exist, with `flock` on
+    POSIX and `msvcrt.locking` on Windows. Both are released by the OS if the
+    process dies.
+    """
+    with open(lock_path, "a+b") as f:
+        if sys.platform == "win32":
+            import msvcrt
+
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK gives up after 10 secs, keep waiting.
+                    continue
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
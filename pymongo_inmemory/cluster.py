@@ -0,0 +1,140 @@
+"""Local sharded cluster
+
+`ShardedCluster` brings up a config server replica set, a number of shard replica
+sets and a `mongos` router in front of them, all on local ports:
+::
+    with ShardedCluster(shards=2) as cluster:
+        client = pymongo.MongoClient(cluster.connection_string)
+        client.admin.command("shardCollection", "pimtest.users", key={"_id": "hashed"})
+"""
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+
+import pymongo
+
+from .context import Context
+from .mongod import Mongod
+from .replset import ReplicaSet
+
+logger = logging.getLogger("PYMONGOIM_CLUSTER")
+
+
+class Mongos(Mongod):
+    """Wrapper for a `mongos` router of the config servers at `configdb`, which is
+    given as `<replica set name>/<host:port>,...`.
+    """
+
+    def __init__(self, pim_context: Context, configdb):
+        super().__init__(pim_context)
+        self.configdb = configdb
+
+    def _boot_command(self):
+        # Router doesn't store data, data folder only holds its log.
+        return [
+            os.path.join(self.bin_folder, "mongos"),
+            "--configdb",
+            self.configdb,
+            "--logpath",
+            self.log_path,
+        ] + self.config.listen_args
+
+
+class ShardedCluster:
+    """Sharded cluster of `shards` replica sets with `shard_members` members each,
+    and a config server replica set with `config_members` members. Replica sets boot
+    in parallel, then the router starts and the shards are added to it.
+
+    It can be used in place of a `Mongod`, connections go through the router.
+    """
+
+    def __init__(
+        self, pim_context: Context = None, shards=None, shard_members=1, config_members=1
+    ):
+        self._pim_context = Context() if pim_context is None else pim_context
+        shards = self._pim_context.cluster_shards if shards is None else shards
+        if shards < 1:
+            raise ValueError("Sharded cluster needs at least one shard.")
+        if (
+            self._pim_context.mongod_port is not None
+            or self._pim_context.mongod_data_folder is not None
+        ):
+            raise ValueError("Cluster components can't share a port or data folder.")
+
+        self.config_servers = ReplicaSet(
+            self._pim_context, members=config_members, name="pimconfig"
+        )
+        for md in self.config_servers.mongods:
+            md.config.cluster_role = "configsvr"
+
+        self.shards = []
+        for index in range(shards):
+            shard = ReplicaSet(
+                self._pim_context, members=shard_members, name="pimshard{}".format(index)
+            )
+            for md in shard.mongods:
+                md.config.cluster_role = "shardsvr"
+            self.shards.append(shard)
+
+        self.mongos = Mongos(
+            self._pim_context,
+            "{}/{}".format(
+                self.config_servers.name, ",".join(self.config_servers.hosts)
+            ),
+        )
+        self._shards_added = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    @property
+    def replica_sets(self):
+        return [self.config_servers] + self.shards
+
+    def start(self):
+        logger.info("Starting sharded cluster with {} shards.".format(len(self.shards)))
+        try:
+            self._each_replica_set(lambda rs: rs.start())
+            self.mongos.start()
+            if not self._shards_added:
+                self._add_shards()
+        except Exception:
+            self.stop()
+            raise
+        logger.info("Sharded cluster is ready.")
+
+    def stop(self, clean_up=True):
+        self.mongos.stop(clean_up=clean_up)
+        self._each_replica_set(lambda rs: rs.stop(clean_up=clean_up))
+
+    @property
+    def is_running(self):
+        return self.mongos.is_running and all(
+            rs.is_running for rs in self.replica_sets
+        )
+
+    @property
+    def connection_string(self):
+        return self.mongos.connection_string
+
+    def mongodump(self, database, collection):
+        return self.mongos.mongodump(database, collection)
+
+    def _add_shards(self):
+        with pymongo.MongoClient(self.mongos.connection_string) as client:
+            for shard in self.shards:
+                shard_address = "{}/{}".format(shard.name, ",".join(shard.hosts))
+                logger.debug("Adding shard {}".format(shard_address))
+                client["admin"].command("addShard", shard_address, name=shard.name)
+        self._shards_added = True
+
+    def _each_replica_set(self, action):
+        with ThreadPoolExecutor(
+            max_workers=len(self.replica_sets), thread_name_prefix="pymongoim"
+        ) as pool:
+            for future in [pool.submit(action, rs) for rs in self.replica_sets]:
+                future.result()
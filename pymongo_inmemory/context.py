@@ -4,6 +4,8 @@ import logging
 import os
 from os import path
 import platform
+import sys
+import tempfile
 
 from ._utils import make_semver, mkdir_ifnot_exist
 from .downloader._urls import best_url
@@ -20,11 +22,29 @@ class OperatingSystemNotFound(ValueError):
 
 def _coercion(constructor, value):
     if constructor == bool:
-        return value == "True"
+        return value if isinstance(value, bool) else value == "True"
     else:
         return constructor(value)
 
 
+def _port_range(value):
+    "Parse port ranges given as `start-end`, both ends inclusive"
+    if isinstance(value, range):
+        return value
+    start, end = (int(x) for x in str(value).split("-"))
+    return range(start, end + 1)
+
+
+def _default_broker_address():
+    if sys.platform == "win32":
+        return "127.0.0.1:27099"
+    # Unix socket paths are limited to about 100 characters, the cache folder can be
+    # nested too deep.
+    return path.join(
+        tempfile.gettempdir(), "pymongoim-broker-{}.sock".format(os.getuid())
+    )
+
+
 def _check_environment_vars(option, fallback=None):
     "Check if `option` is defined in environment variables"
     return os.environ.get("PYMONGOIM__{}".format(str(option).upper()), default=fallback)
@@ -103,9 +123,37 @@ class Context:
     ) -> None:
         self.mongo_version = conf("mongo_version", version)
         self.mongod_port = conf("mongod_port", None, coerce_with=int)
+        self.mongod_port_range = conf(
+            "mongod_port_range", None, coerce_with=_port_range
+        )
         self.mongod_data_folder = conf("mongod_data_folder", None)
+        self.use_unix_socket = conf("use_unix_socket", False, coerce_with=bool)
         self.dbname = conf("dbname", "pimtest")
+        self.use_ram_disk = conf("use_ram_disk", True, coerce_with=bool)
+        self.ram_disk_folder = conf("ram_disk_folder", "/dev/shm")
+        self.ram_disk_min_free_mb = conf("ram_disk_min_free_mb", 512, coerce_with=int)
         self.mongo_client_host = conf("mongo_client_host", None)
+        self.mongod_profile = conf("mongod_profile", "default")
+        self.mongod_extra_args = conf("mongod_extra_args", None)
+        self.auto_size = conf("auto_size", False, coerce_with=bool)
+        self.auto_size_instances = conf("auto_size_instances", 1, coerce_with=int)
+        self.mongod_start_timeout = conf("mongod_start_timeout", 60, coerce_with=float)
+        self.mongod_shutdown_method = conf("mongod_shutdown_method", "signal")
+        self.mongod_shutdown_timeout = conf(
+            "mongod_shutdown_timeout", 10, coerce_with=float
+        )
+        self.pool_size = conf("pool_size", 2, coerce_with=int)
+        self.client_pool_size = conf("client_pool_size", None, coerce_with=int)
+        self.client_compressors = conf("client_compressors", None)
+        self.client_timeout_ms = conf("client_timeout_ms", None, coerce_with=int)
+        self.replica_set_members = conf("replica_set_members", 0, coerce_with=int)
+        self.replica_set_name = conf("replica_set_name", "pimrs")
+        self.cluster_shards = conf("cluster_shards", 0, coerce_with=int)
+        self.lazy_start = conf("lazy_start", False, coerce_with=bool)
+        self.idle_timeout = conf("idle_timeout", None, coerce_with=float)
+        self.persistent = conf("persistent", False, coerce_with=bool)
+        self.broker_address = conf("broker_address", _default_broker_address())
+        self.broker_lease_ttl = conf("broker_lease_ttl", 300, coerce_with=float)
 
         self.operating_system = self._build_operating_system_info(os_name)
         self.os_version = conf("os_version", os_ver)
@@ -125,6 +173,12 @@ class Context:
         self.extract_folder = conf(
             "extract_folder", mkdir_ifnot_exist(CACHE_FOLDER, "extract")
         )
+        self.template_folder = conf(
+            "template_folder", mkdir_ifnot_exist(CACHE_FOLDER, "templates")
+        )
+        self.persistent_folder = conf(
+            "persistent_folder", mkdir_ifnot_exist(CACHE_FOLDER, "persistent")
+        )
         self.archive_folder = mkdir_ifnot_exist(self.download_folder, self.url_hash)
         self.extracted_folder = mkdir_ifnot_exist(self.extract_folder, self.url_hash)
         self.storage_engine = self._build_storage_engine()
@@ -133,8 +187,32 @@ class Context:
         return (
             f"Mongo Version {self.mongo_version}\n"
             f"MongoD Port {self.mongod_port}\n"
+            f"MongoD Port Range {self.mongod_port_range}\n"
             f"MongoD Data Folder {self.mongod_data_folder}\n"
+            f"Use Unix Socket {self.use_unix_socket}\n"
             f"Database Name {self.dbname}\n"
+            f"Use RAM Disk {self.use_ram_disk}\n"
+            f"RAM Disk Folder {self.ram_disk_folder}\n"
+            f"RAM Disk Min Free MiB {self.ram_disk_min_free_mb}\n"
+            f"MongoD Profile {self.mongod_profile}\n"
+            f"MongoD Extra Args {self.mongod_extra_args}\n"
+            f"Auto Size {self.auto_size}\n"
+            f"Auto Size Instances {self.auto_size_instances}\n"
+            f"MongoD Start Timeout {self.mongod_start_timeout}\n"
+            f"MongoD Shutdown Method {self.mongod_shutdown_method}\n"
+            f"MongoD Shutdown Timeout {self.mongod_shutdown_timeout}\n"
+            f"Pool Size {self.pool_size}\n"
+            f"Client Pool Size {self.client_pool_size}\n"
+            f"Client Compressors {self.client_compressors}\n"
+            f"Client Timeout MS {self.client_timeout_ms}\n"
+            f"Replica Set Members {self.replica_set_members}\n"
+            f"Replica Set Name {self.replica_set_name}\n"
+            f"Cluster Shards {self.cluster_shards}\n"
+            f"Lazy Start {self.lazy_start}\n"
+            f"Idle Timeout {self.idle_timeout}\n"
+            f"Persistent {self.persistent}\n"
+            f"Broker Address {self.broker_address}\n"
+            f"Broker Lease TTL {self.broker_lease_ttl}\n"
             f"OS Name {self.operating_system}\n"
             f"OS Version {self.os_version}\n"
             f"Download URL {self.download_url}\n"
@@ -144,6 +222,8 @@ class Context:
             f"Use Local MongoD {self.use_local_mongod}\n"
             f"Download Folder {self.download_folder}\n"
             f"Extract Folder {self.extract_folder}\n"
+            f"Template Folder {self.template_folder}\n"
+            f"Persistent Folder {self.persistent_folder}\n"
             f"Storage engine {self.storage_engine}\n"
         )
 
@@ -5,10 +5,16 @@ from os import path
 import shutil
 import tarfile
 import tempfile
+from typing import TYPE_CHECKING
 import urllib.request as request
 from urllib.error import HTTPError
 
-from ..context import Context
+from .._utils import file_lock
+
+if TYPE_CHECKING:
+    # Context imports the URL bank of this package, importing it here at runtime
+    # would be circular.
+    from ..context import Context
 
 
 logger = logging.getLogger("PYMONGOIM_DOWNLOADER")
@@ -109,19 +115,22 @@ def _get_mongod(extracted_folder):
             return binfile_path
 
 
-def download(pim_context: Context):
+def download(pim_context: "Context"):
     dl_url = pim_context.download_url
     should_ignore_cache = pim_context.ignore_cache
 
     logger.debug("Downloading MongoD from {}".format(dl_url))
     archive_file = path.join(pim_context.archive_folder, "archive")
 
-    if should_ignore_cache or not path.isfile(archive_file):
-        logger.info("Archive file is not found, {}".format(archive_file))
-        _download_file(dl_url, archive_file)
-        _extract(archive_file, pim_context.extracted_folder)
+    # Parallel test runners share the cache folders, only one process at a time
+    # downloads and extracts, the others find the result when they get the lock.
+    with file_lock(path.join(pim_context.archive_folder, ".lock")):
+        if should_ignore_cache or not path.isfile(archive_file):
+            logger.info("Archive file is not found, {}".format(archive_file))
+            _download_file(dl_url, archive_file)
+            _extract(archive_file, pim_context.extracted_folder)
 
-    if _get_mongod(pim_context.extracted_folder) is None:
-        _extract(archive_file, pim_context.extracted_folder)
+        if _get_mongod(pim_context.extracted_folder) is None:
+            _extract(archive_file, pim_context.extracted_folder)
 
     return path.dirname(_get_mongod(pim_context.extracted_folder))
@@ -5,32 +5,111 @@ This module can be used for spinning up an ephemeral MongoDB instance:
     python -m python_inmemory.mongod
 """
 import atexit
+import contextlib
+import json
 import logging
 import os
+import shutil
 import signal
 import subprocess
+import sys
 import time
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from tempfile import TemporaryDirectory
+from urllib.parse import quote
 
 import pymongo
+from pymongo import monitoring
 
-from ._utils import find_open_port
+from . import _sizing
+from ._profiles import CONSTRAINED_PROFILE, cache_size_gb, get_profile, launch_args
+from ._utils import (
+    RESERVATION_SURVIVES_BIND,
+    clone_tree,
+    file_lock,
+    reserve_port,
+    wait_for_exit,
+)
 from .downloader import download
-from .context import Context
+from .context import Context, conf
 
 logger = logging.getLogger("PYMONGOIM_MONGOD")
+
+# Readiness polling starts fast and backs off to this interval. Waiting is done on the
+# process itself, so an exiting mongod wakes the loop up immediately.
+_READY_POLL_MIN = 0.01
+_READY_POLL_MAX = 0.1
+_PING_TIMEOUT_MS = 250
+
+# Files in a data folder that don't belong to a snapshot.
+_SNAPSHOT_IGNORE = ("mongod.lock", "mongod.log*", "diagnostic.data", "*.sock")
+# Unix socket paths longer than this don't fit in `sockaddr_un` on Linux and macOS.
+_UNIX_SOCKET_MAX_PATH = 103
+
+# Commands writing to the collection named by their first field.
+_WRITE_COMMANDS = ("insert", "update", "delete", "findAndModify", "createIndexes")
+_SYSTEM_DATABASES = ("admin", "config", "local")
+
+
+class MongodStartupError(RuntimeError):
+    pass
+
+
+class _ProcessRegistry:
+    """Thread safe collection of the Popen objects of spawned daemons. Exited ones
+    are dropped as new ones are added.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._procs = []
+
+    def add(self, proc):
+        with self._lock:
+            self._procs = [p for p in self._procs if p.poll() is None]
+            self._procs.append(proc)
+
+    def running(self):
+        with self._lock:
+            return [p for p in self._procs if p.poll() is None]
+
+
 # Holds references to open Popen objects which spawn MongoDB daemons.
-_popen_objs = []
+_registry = _ProcessRegistry()
+
+# Keys of the cache report, and the `wiredTiger.cache` serverStatus statistics they
+# come from.
+_CACHE_REPORT_STATS = (
+    ("max_bytes", "maximum bytes configured"),
+    ("bytes_in_cache", "bytes currently in the cache"),
+    ("pages_read", "pages read into cache"),
+    ("pages_evicted_modified", "modified pages evicted"),
+    ("pages_evicted_unmodified", "unmodified pages evicted"),
+    ("pages_evicted_by_app_threads", "pages evicted by application threads"),
+    ("app_thread_eviction_usecs", "application thread time evicting (usecs)"),
+)
 
 
 @atexit.register
 def cleanup():
+    """Terminate all spawned daemons. Signals are sent to all of them first and then
+    they are waited for together, so the total time is bound by the slowest one.
+    Daemons still running after `mongod_shutdown_timeout` seconds are killed.
+    """
     logger.info("Cleaning created processes.")
-    for o in _popen_objs:
-        if o.poll() is None:
-            logger.debug("Found {}".format(o.pid))
-            o.terminate()
+    running = _registry.running()
+    for o in running:
+        logger.debug("Found {}".format(o.pid))
+        o.terminate()
+
+    timeout = conf("mongod_shutdown_timeout", 10, coerce_with=float)
+    deadline = time.monotonic() + timeout
+    for o in running:
+        if wait_for_exit(o, max(0, deadline - time.monotonic())) is None:
+            logger.warning("Killing {}, it didn't exit in time.".format(o.pid))
+            o.kill()
+            o.wait()
 
 
 def clean_before_kill(signum, stack):
@@ -47,19 +126,162 @@ if threading.current_thread() is threading.main_thread():
     signal.signal(signal.SIGTERM, clean_before_kill)
 
 
+def start_many(n, pim_context: Context = None):
+    """Start `n` daemons concurrently, so that it takes about as long as starting the
+    slowest one. If any of them fails to start, all are stopped and the error is
+    raised.
+
+    All daemons share `pim_context`, so it can't have a fixed `mongod_port` or
+    `mongod_data_folder`.
+
+    Returns
+    -------
+    list of Mongod: Started daemons.
+    """
+    pim_context = Context() if pim_context is None else pim_context
+    if pim_context.mongod_port is not None or pim_context.mongod_data_folder is not None:
+        raise ValueError("Daemons started together can't share a port or data folder.")
+
+    mongods = [Mongod(pim_context) for _ in range(n)]
+    _start_concurrently(mongods)
+    return mongods
+
+
+def _start_concurrently(mongods):
+    if not mongods:
+        return
+    for md in mongods:
+        md.config.fleet_size = len(mongods)
+    # Resolve the binary once, before the daemons start in parallel.
+    mongods[0].bin_folder
+
+    logger.info("Starting {} daemons.".format(len(mongods)))
+    with ThreadPoolExecutor(
+        max_workers=len(mongods), thread_name_prefix="pymongoim"
+    ) as pool:
+        futures = [pool.submit(md.start) for md in mongods]
+        errors = [f.exception() for f in futures if f.exception() is not None]
+    if errors:
+        stop_many(mongods)
+        raise errors[0]
+
+
+def stop_many(mongods):
+    "Stop daemons concurrently"
+    if not mongods:
+        return
+    with ThreadPoolExecutor(
+        max_workers=len(mongods), thread_name_prefix="pymongoim"
+    ) as pool:
+        for future in [pool.submit(md.stop) for md in mongods]:
+            future.result()
+
+
+def client_options(pim_context: Context):
+    "Keyword arguments of `pymongo.MongoClient` from the `client_*` configuration"
+    options = {}
+    if pim_context.client_pool_size is not None:
+        options["maxPoolSize"] = pim_context.client_pool_size
+    if pim_context.client_compressors is not None:
+        options["compressors"] = pim_context.client_compressors
+    if pim_context.client_timeout_ms is not None:
+        options["timeoutMS"] = pim_context.client_timeout_ms
+    return options
+
+
+def _ping_timeout():
+    "Deadline for pings, whatever timeouts the client is configured with"
+    if hasattr(pymongo, "timeout"):
+        return pymongo.timeout(_PING_TIMEOUT_MS / 1000)
+    # pymongo < 4.2, the daemon's own client has short timeouts instead.
+    return contextlib.nullcontext()
+
+
 class MongodConfig:
     def __init__(self, pim_context: Context):
         self._pim_context = pim_context
         self.local_address = "127.0.0.1"
-        self.engine = pim_context.storage_engine
+        self.repl_set = None
+        # Either "configsvr" or "shardsvr" for members of a sharded cluster.
+        self.cluster_role = None
+        self.profile = pim_context.mongod_profile
+        self.engine = get_profile(self.profile).engine or pim_context.storage_engine
+        # Path of the unix socket to listen on instead of TCP, see `use_unix_socket`.
+        self.unix_socket = None
+        # Daemons started together with this one, auto sizing shares the host
+        # between them.
+        self.fleet_size = None
+        self._port = None
+        self._port_reservation = None
 
     @property
     def port(self):
-        set_port = self._pim_context.mongod_port
-        if set_port is None:
-            return str(find_open_port(range(27017, 28000)))
-        else:
-            return str(set_port)
+        """Port of the daemon. Resolved once, if it isn't configured a free port is
+        reserved until `release_port` is called. `None` when listening on a unix
+        socket.
+        """
+        if self.unix_socket is not None:
+            return None
+        if self._port is None:
+            set_port = self._pim_context.mongod_port
+            if set_port is None:
+                self._port_reservation = reserve_port(
+                    self._pim_context.mongod_port_range, self.local_address
+                )
+                self._port = str(self._port_reservation.port)
+            else:
+                self._port = str(set_port)
+        return self._port
+
+    @property
+    def sizing(self):
+        """Share of the host for the daemon if `auto_size` is on, `None` otherwise.
+
+        Every daemon gets the same share, of the larger of `auto_size_instances` and
+        the number of daemons started together with it. The cache is never larger
+        than the launch profile's.
+        """
+        if not self._pim_context.auto_size or self.profile == CONSTRAINED_PROFILE:
+            return None
+        instances = max(self._pim_context.auto_size_instances, self.fleet_size or 1)
+        return _sizing.compute(instances, max_cache_gb=cache_size_gb(self.profile))
+
+    @property
+    def launch_args(self):
+        """Options of the launch profile, supported by the version and the engine.
+        Auto sizing options replace the profile's.
+        """
+        sizing = self.sizing
+        return launch_args(
+            self.profile,
+            version=self._pim_context.downloaded_version,
+            engine=self.engine,
+            extra_args=self._pim_context.mongod_extra_args,
+            overrides=_sizing.flags(sizing) if sizing is not None else (),
+        )
+
+    @property
+    def listen_args(self):
+        "Command line arguments of where the daemon listens"
+        if self.unix_socket is not None:
+            # The prefix is where mongod puts its default socket, next to ours.
+            return [
+                "--unixSocketPrefix",
+                os.path.dirname(self.unix_socket),
+                "--bind_ip",
+                self.unix_socket,
+            ]
+        return ["--port", self.port, "--bind_ip", self.local_address]
+
+    def set_port(self, port):
+        "Use `port` instead of the configured or reserved one, `None` to reserve again"
+        self.release_port()
+        self._port = None if port is None else str(port)
+
+    def release_port(self):
+        if self._port_reservation is not None:
+            self._port_reservation.release()
+            self._port_reservation = None
 
     @property
     def connection_string(self):
@@ -69,49 +291,284 @@ class MongodConfig:
             else:
                 self.local_address = self._pim_context.mongo_client_host
 
-        if self.local_address is not None and self.port is not None:
-            if self._pim_context.dbname is None:
-                return "mongodb://{host}:{port}".format(
-                    host=self.local_address, port=self.port
-                )
-            else:
-                return "mongodb://{host}:{port}/{dbname}".format(
-                    host=self.local_address,
-                    port=self.port,
-                    dbname=self._pim_context.dbname,
-                )
+        if self.unix_socket is not None:
+            host = quote(self.unix_socket, safe="")
+        elif self.local_address is not None and self.port is not None:
+            host = "{}:{}".format(self.local_address, self.port)
+        else:
+            return None
+
+        if self._pim_context.dbname is None:
+            return "mongodb://{host}".format(host=host)
+        else:
+            return "mongodb://{host}/{dbname}".format(
+                host=host, dbname=self._pim_context.dbname
+            )
+
+
+class Snapshot:
+    """Point in time copy of a `Mongod` data folder, see `Mongod.snapshot`."""
+
+    def __init__(self, folder: TemporaryDirectory, version):
+        self._folder = folder
+        self.version = version
+        self.created_at = time.time()
+
+    @property
+    def path(self):
+        return self._folder.name
+
+    def discard(self):
+        self._folder.cleanup()
+
+
+class _LogWatcher:
+    """Incrementally reads a mongod log file and reports when the daemon logs that it
+    is accepting connections. Both the legacy text log format and the structured JSON
+    log format (MongoDB 4.4+) contain the same marker.
+    """
+
+    READY_MARKER = b"waiting for connections"
+
+    def __init__(self, log_path):
+        self._log_path = log_path
+        self._offset = 0
+        self._tail = b""
+        # Log of an earlier run in the same data folder. The new daemon either rotates
+        # it away, or appends to it with `--logappend`, its lines are never read.
+        try:
+            stat = os.stat(log_path)
+            self._stale = (stat.st_ino, stat.st_size)
+        except FileNotFoundError:
+            self._stale = None
+
+    def saw_ready(self):
+        try:
+            with open(self._log_path, "rb") as logfile:
+                self._skip_stale(logfile)
+                logfile.seek(self._offset)
+                chunk = logfile.read()
+                self._offset = logfile.tell()
+        except FileNotFoundError:
+            return False
+
+        # Keep the end of the previous chunk, in case the marker was split.
+        text = self._tail + chunk.lower()
+        self._tail = text[1 - len(self.READY_MARKER):]
+        return self.READY_MARKER in text
+
+    def _skip_stale(self, logfile):
+        if self._stale is None:
+            return
+        inode, size = self._stale
+        if os.fstat(logfile.fileno()).st_ino == inode:
+            self._offset = max(self._offset, size)
+        else:
+            # Rotated, the file is the new daemon's from the start.
+            self._stale = None
+            self._offset = 0
+            self._tail = b""
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Alive, but owned by another user.
+        return True
+    return True
+
+
+class _PersistentState:
+    """Pidfile, connection metadata and data folder of a daemon that outlives the
+    process that started it, kept in `persistent_folder`.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.lock_path = os.path.join(folder, ".lock")
+        self.pid_path = os.path.join(folder, "mongod.pid")
+        self.metadata_path = os.path.join(folder, "mongod.json")
+        self.data_folder = os.path.join(folder, "data")
+        os.makedirs(self.data_folder, exist_ok=True)
+
+    def read(self):
+        try:
+            with open(self.metadata_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def write(self, metadata):
+        # Replaced in one go, so readers never see half a file.
+        for file_path, content in (
+            (self.pid_path, str(metadata["pid"])),
+            (self.metadata_path, json.dumps(metadata, indent=2)),
+        ):
+            with open(file_path + ".tmp", "w") as f:
+                f.write(content)
+            os.replace(file_path + ".tmp", file_path)
+
+    def clear(self):
+        for file_path in (self.pid_path, self.metadata_path):
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+    def wipe_data(self):
+        shutil.rmtree(self.data_folder)
+        os.makedirs(self.data_folder)
+
+
+def _split_namespace(namespace):
+    database, _, collection = namespace.partition(".")
+    return database, collection
+
+
+class _WriteTracker(monitoring.CommandListener):
+    """Records the namespaces written to, by the clients it is registered with.
+
+    Collections created with `create` are kept apart from the rest, they didn't exist
+    at the last reset, so they are always dropped.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._written = set()
+        self._created = set()
+        # Command events are published on the thread running the command.
+        self._local = threading.local()
+
+    @contextlib.contextmanager
+    def muted(self):
+        "Ignore commands run by the current thread in the block"
+        self._local.muted = True
+        try:
+            yield
+        finally:
+            self._local.muted = False
+
+    def started(self, event):
+        if getattr(self._local, "muted", False):
+            return
+        written, created = self._namespaces(event.command_name, event)
+        written = {ns for ns in written if ns[0] not in _SYSTEM_DATABASES}
+        created = {ns for ns in created if ns[0] not in _SYSTEM_DATABASES}
+        if written or created:
+            with self._lock:
+                self._written |= written
+                self._created |= created
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    def take(self):
+        """Namespaces written and created since the last call.
+
+        Returns
+        -------
+        tuple of set: (database, collection) pairs written to, and created.
+        """
+        with self._lock:
+            written, created = self._written, self._created
+            self._written, self._created = set(), set()
+        return written - created, created
+
+    @staticmethod
+    def _namespaces(name, event):
+        command, database = event.command, event.database_name
+        if name in _WRITE_COMMANDS:
+            return {(database, command[name])}, set()
+        if name == "create":
+            return set(), {(database, command[name])}
+        if name == "aggregate":
+            return _output_namespaces(database, command.get("pipeline") or []), set()
+        if name == "renameCollection":
+            return set(), {_split_namespace(command["to"])}
+        if name == "bulkWrite":
+            return {_split_namespace(ns["ns"]) for ns in command["nsInfo"]}, set()
+        return set(), set()
+
+
+def _output_namespaces(database, pipeline):
+    "Namespace an aggregation writes to with `$out` or `$merge`"
+    if not pipeline:
+        return set()
+    stage = pipeline[-1]
+    if "$out" in stage:
+        target = stage["$out"]
+    elif "$merge" in stage:
+        target = stage["$merge"]
+        target = target["into"] if isinstance(target, dict) else target
+    else:
+        return set()
+    if isinstance(target, dict):
+        return {(target.get("db", database), target["coll"])}
+    return {(database, target)}
 
 
 class Mongod:
     """Wrapper for MongoDB daemon instance. Can be used with context managers.
-    During contruction it calls `download` function of `downloader` to get the
+    Before the first start it calls `download` function of `downloader` to get the
     defined MongoDB version.
 
     Daemon is managed by `subprocess.Popen`. all Popen objects are registered
     with `atexit` module to ensure clean up.
+
+    With `on_disk`, or a `template` to boot from, ephemeralForTest is replaced by
+    wiredTiger, for daemons that need data files, like replica set members.
     """
 
-    def __init__(self, pim_context: Context):
+    def __init__(self, pim_context: Context, template=None, on_disk=False):
         self._pim_context = Context() if pim_context is None else pim_context
         logger.info("Running MongoD in the following context")
         logger.info(self._pim_context)
 
-        logger.info("Checking binary")
-        if self._pim_context.use_local_mongod:
-            logger.warn("Using local mongod instance")
-            self._bin_folder = ""
-        else:
-            self._bin_folder = download(self._pim_context)
-
+        self._bin_folder = None
         self._proc = None
         self._connection_string = None
+        self.startup_duration = None
 
         self.config = MongodConfig(self._pim_context)
+        # Cache statistics taken at shutdown with the constrained profile.
+        self.cache_report = None
+
+        # Data folder to clone on the first start, see `templates`.
+        self._template = template
+        # Decided before the data folder is created, on a RAM disk or not by engine.
+        if (on_disk or template is not None) and (
+            self.config.engine == "ephemeralForTest"
+        ):
+            logger.info("Using wiredTiger storage engine to keep data files.")
+            self.config.engine = "wiredTiger"
 
-        self._temp_data_folder = TemporaryDirectory(prefix="pymongoim")
-        self._using_tmp_folder = self._pim_context.mongod_data_folder is None
+        # Persistent daemons are left running, and reused by the next process.
+        self._persistent = None
+        self._adopted_pid = None
+        if self._pim_context.persistent:
+            if sys.platform == "win32":
+                logger.warning("Persistent mode isn't supported on Windows.")
+            else:
+                self._persistent = _PersistentState(
+                    self._pim_context.persistent_folder
+                )
+
+        self._using_tmp_folder = (
+            self._pim_context.mongod_data_folder is None and self._persistent is None
+        )
+        self._temp_data_folder = self._make_temp_data_folder()
+        if self._pim_context.use_unix_socket:
+            self._use_unix_socket()
 
-        self._client = pymongo.MongoClient(self.connection_string)
+        # Register with clients, e.g. `event_listeners=[md.write_tracker]`, whose
+        # writes `reset` should roll back.
+        self.write_tracker = _WriteTracker()
+
+        self._client = self._make_client()
 
     def __enter__(self):
         self.start()
@@ -120,45 +577,230 @@ class Mongod:
     def __exit__(self, *args):
         self.stop()
 
+    def _use_unix_socket(self):
+        if sys.platform == "win32":
+            logger.warning("Unix sockets aren't supported on Windows, using TCP.")
+            return
+        unix_socket = os.path.join(self.data_folder, "mongod.sock")
+        if len(unix_socket) > _UNIX_SOCKET_MAX_PATH:
+            logger.warning(
+                "Unix socket path {} is too long, using TCP.".format(unix_socket)
+            )
+            return
+        self.config.unix_socket = unix_socket
+
+    @property
+    def client(self):
+        """`pymongo.MongoClient` of the daemon. Health checks, snapshots and resets go
+        through it, and it can be shared by code connecting in this process, so that
+        there is one connection pool per daemon.
+        """
+        if self._client is None:
+            self._client = self._make_client()
+        return self._client
+
+    def attach_client(self, client: pymongo.MongoClient):
+        """Use `client` instead of the daemon's own, which is closed. The attached
+        client isn't closed by `stop`, it belongs to the caller.
+        """
+        if client is not self._client:
+            self._close_client()
+            self._client = client
+            self._owns_client = False
+
+    def detach_client(self):
+        "Stop using the attached client, the daemon's own is created on first use"
+        if not self._owns_client:
+            self._client = None
+            self._owns_client = True
+
+    def _make_client(self):
+        self._owns_client = True
+        options = client_options(self._pim_context)
+        if not hasattr(pymongo, "timeout"):
+            options.update(
+                serverSelectionTimeoutMS=_PING_TIMEOUT_MS,
+                connectTimeoutMS=_PING_TIMEOUT_MS,
+            )
+        return pymongo.MongoClient(
+            self.connection_string,
+            connect=False,
+            event_listeners=[self.write_tracker],
+            **options,
+        )
+
+    def _close_client(self):
+        # A new one is created on first use, should the daemon start again.
+        if self._owns_client and self._client is not None:
+            self._client.close()
+            self._client = None
+
+    @contextlib.contextmanager
+    def _shutdown_client(self):
+        """Client of its own for the `shutdown` command, the daemon's may be closed.
+        Short timeouts, closing it may try to end sessions on the stopped daemon.
+        """
+        client = pymongo.MongoClient(
+            self.connection_string,
+            serverSelectionTimeoutMS=_PING_TIMEOUT_MS,
+            connectTimeoutMS=_PING_TIMEOUT_MS,
+        )
+        try:
+            yield client
+        finally:
+            client.close()
+
     def start(self):
+        if self._persistent is None:
+            self._start()
+            return
+        with file_lock(self._persistent.lock_path):
+            if not self._adopt():
+                self._start()
+                self._persistent.write(self._persistent_metadata())
+
+    def _start(self):
+        started_at = self._spawn()
+        try:
+            self._wait_until_ready(started_at)
+        finally:
+            self.config.release_port()
+        self._started(started_at)
+
+    def _spawn(self):
+        """Prepare the data folder and start the daemon process.
+
+        Returns
+        -------
+        float: Monotonic time the process was started at.
+        """
         self._check_lock()
+        if self._template is not None:
+            if os.listdir(self.data_folder):
+                raise ValueError(
+                    "Data folder {} isn't empty, a template can't be cloned into "
+                    "it.".format(self.data_folder)
+                )
+            logger.info("Cloning template {}".format(self._template))
+            clone_tree(self._template, self.data_folder)
+            self._template = None
         self.log_path = os.path.join(self.data_folder, "mongod.log")
 
         logger.info("Starting mongod with {cs}...".format(cs=self.connection_string))
+        sizing = self.config.sizing
+        if sizing is not None:
+            logger.info("Auto sizing: {}".format(sizing))
+            _sizing.raise_file_limit(sizing.max_files)
+        boot_command = self._boot_command()
+        logger.debug(boot_command)
+        if not RESERVATION_SURVIVES_BIND:
+            self.config.release_port()
+        # Created before the process, to tell an earlier run's log from its own.
+        self._log_watcher = _LogWatcher(self.log_path)
+        started_at = time.monotonic()
+        if self._persistent is None:
+            self._proc = subprocess.Popen(boot_command)
+            _registry.add(self._proc)
+        else:
+            # Own session, so that signals to the process group, like Ctrl+C, don't
+            # reach it. Not registered for the clean up at exit either.
+            self._proc = subprocess.Popen(boot_command, start_new_session=True)
+        return started_at
+
+    def _started(self, started_at):
+        self.startup_duration = time.monotonic() - started_at
+        logger.info("Started mongod in {:.3f} secs.".format(self.startup_duration))
+        logger.info("Connect with: {cs}".format(cs=self.connection_string))
+
+    def _boot_command(self):
         boot_command = [
-            os.path.join(self._bin_folder, "mongod"),
+            os.path.join(self.bin_folder, "mongod"),
             "--dbpath",
             self.data_folder,
             "--logpath",
             self.log_path,
-            "--port",
-            self.config.port,
-            "--bind_ip",
-            self.config.local_address,
-        ]
+        ] + self.config.listen_args
         if self.config.engine is not None:
             boot_command.append("--storageEngine")
             boot_command.append(self.config.engine)
-        logger.debug(boot_command)
-        self._proc = subprocess.Popen(boot_command)
-        _popen_objs.append(self._proc)
-        while not self.is_healthy:
-            pass
-        logger.info("Started mongod.")
-        logger.info("Connect with: {cs}".format(cs=self.connection_string))
+        if self.config.repl_set is not None:
+            boot_command.append("--replSet")
+            boot_command.append(self.config.repl_set)
+        if self.config.cluster_role is not None:
+            boot_command.append("--{}".format(self.config.cluster_role))
+        return boot_command + self.config.launch_args
 
-    def stop(self):
-        logger.info("Sending kill signal to mongod.")
-        self._proc.terminate()
-        while self._proc.poll() is None:
-            logger.debug("Waiting for MongoD shutdown.")
-            time.sleep(1)
-        self._clean_up()
+    def stop(self, clean_up=True):
+        """Stop the daemon. With `clean_up=False` the data folder is kept, and the
+        daemon can be started again with the same data.
+
+        In persistent mode the daemon is left running for the next process, unless
+        `clean_up=False` is given.
+        """
+        if self.config.profile == CONSTRAINED_PROFILE and self.is_running:
+            self._report_cache()
+        # While the daemon runs, closing ends the client's sessions on it, which
+        # waits for the server selection timeout once it is gone.
+        self._close_client()
+        if self._persistent is not None and clean_up:
+            logger.info("Leaving persistent mongod running.")
+            return
+        if self.is_running:
+            self._shutdown()
+        if clean_up:
+            self._clean_up()
+
+    def cache_stats(self):
+        """WiredTiger cache statistics of the running daemon. Statistics the server
+        doesn't have are `None`.
+
+        Returns
+        -------
+        dict: Keys are in `_CACHE_REPORT_STATS`.
+        """
+        status = self.client["admin"].command("serverStatus")
+        cache = status.get("wiredTiger", {}).get("cache", {})
+        return {key: cache.get(stat) for key, stat in _CACHE_REPORT_STATS}
+
+    def _report_cache(self):
+        try:
+            self.cache_report = self.cache_stats()
+        except pymongo.errors.PyMongoError:
+            logger.warning("Couldn't take cache statistics.", exc_info=True)
+            return
+        logger.info(
+            "Cache report: {}".format(
+                ", ".join(
+                    "{} {}".format(key, value)
+                    for key, value in self.cache_report.items()
+                )
+            )
+        )
+
+    @property
+    def bin_folder(self):
+        """Folder of MongoDB binaries, downloaded on first access if needed."""
+        if self._bin_folder is None:
+            logger.info("Checking binary")
+            if self._pim_context.use_local_mongod:
+                logger.warning("Using local mongod instance")
+                self._bin_folder = ""
+            else:
+                self._bin_folder = download(self._pim_context)
+        return self._bin_folder
+
+    @property
+    def is_running(self):
+        if self._adopted_pid is not None:
+            return _pid_alive(self._adopted_pid)
+        return self._proc is not None and self._proc.poll() is None
 
     @property
     def data_folder(self):
         if self._using_tmp_folder:
             return self._temp_data_folder.name
+        elif self._pim_context.mongod_data_folder is None:
+            return self._persistent.data_folder
         else:
             return self._pim_context.mongod_data_folder
 
@@ -177,36 +819,104 @@ class Mongod:
 
     @property
     def is_locked(self):
-        return os.path.exists(os.path.join(self.data_folder, "mongod.lock"))
+        # A cleanly stopped mongod leaves an empty lock file behind.
+        lock_file = os.path.join(self.data_folder, "mongod.lock")
+        return os.path.exists(lock_file) and os.path.getsize(lock_file) > 0
 
     @property
     def is_healthy(self):
-        db = self._client["admin"]
-        status = db.command("serverStatus")
         try:
-            logger.debug("Getting status")
-            uptime = int(status["uptime"])
-        except subprocess.CalledProcessError:
-            logger.debug("Status: Not running")
+            logger.debug("Pinging mongod")
+            with _ping_timeout():
+                self.client["admin"].command("ping")
+        except pymongo.errors.PyMongoError:
+            logger.debug("Status: Not responding")
             return False
         else:
-            if uptime > 0:
-                version = status["version"]
-                logger.debug(
-                    "Status: MongoDB {} running for {} secs".format(version, uptime)
-                )
-                return True
+            logger.debug("Status: Responding")
+            return True
+
+    def snapshot(self):
+        """Take a consistent copy of the data folder of the running daemon. Writes are
+        blocked with `fsyncLock` while the files are copied, which are reflinked where
+        the filesystem supports it.
+
+        Returns
+        -------
+        Snapshot: To be passed to `restore`.
+        """
+        if self.config.engine == "ephemeralForTest":
+            raise RuntimeError(
+                "Storage engine ephemeralForTest doesn't keep data on disk to snapshot."
+            )
+
+        # Sibling of the data folder, so that it is on the same filesystem.
+        folder = TemporaryDirectory(
+            prefix="pymongoim-snapshot", dir=os.path.dirname(self.data_folder)
+        )
+        logger.info("Taking snapshot into {}".format(folder.name))
+        admin = self.client["admin"]
+        admin.command("fsync", lock=True)
+        try:
+            clone_tree(self.data_folder, folder.name, ignore=_SNAPSHOT_IGNORE)
+        finally:
+            admin.command("fsyncUnlock")
+        return Snapshot(folder, self._pim_context.downloaded_version)
+
+    def restore(self, snapshot: Snapshot):
+        """Roll the data folder back to `snapshot`. A running daemon is restarted on
+        the restored data.
+        """
+        logger.info("Restoring snapshot from {}".format(snapshot.path))
+        was_running = self.is_running
+        if was_running:
+            self.stop(clean_up=False)
+
+        for entry in os.scandir(self.data_folder):
+            if entry.name.startswith("mongod.log"):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path)
             else:
-                logger.debug("Status: Just started.")
-                return False
+                os.remove(entry.path)
+        clone_tree(snapshot.path, self.data_folder)
+
+        if was_running:
+            self.start()
+
+    def reset(self, keep_indexes=False):
+        """Empty the collections written to since the last reset, by clients that
+        have `write_tracker` among their event listeners. Much cheaper than starting
+        a new daemon.
+
+        Parameters
+        ----------
+        keep_indexes: bool
+            Delete the documents of written collections instead of dropping them.
+            Collections created since the last reset are dropped regardless.
+        """
+        written, created = self.write_tracker.take()
+        logger.debug(
+            "Resetting {} written and {} created collections.".format(
+                len(written), len(created)
+            )
+        )
+        # The client may be tracked itself, its own deletes aren't writes to reset.
+        with self.write_tracker.muted():
+            for database, collection in sorted(created):
+                self.client[database].drop_collection(collection)
+            for database, collection in sorted(written):
+                if keep_indexes:
+                    self.client[database][collection].delete_many({})
+                else:
+                    self.client[database].drop_collection(collection)
 
     def mongodump(self, database, collection):
-        dump_command = [
-            os.path.join(self._bin_folder, "mongodump"),
-            "--host",
-            self.config.local_address,
-            "--port",
-            self.config.port,
+        if self.config.unix_socket is not None:
+            address = ["--host", self.config.unix_socket]
+        else:
+            address = ["--host", self.config.local_address, "--port", self.config.port]
+        dump_command = [os.path.join(self.bin_folder, "mongodump")] + address + [
             "--out",
             "-",
             "--db",
@@ -221,11 +931,192 @@ class Mongod:
         with open(self.log_path, "r") as logfile:
             return logfile.readlines()
 
+    def _wait_until_ready(self, started_at):
+        """Block until mongod accepts connections.
+
+        The log file is watched for the readiness event. Once the polling interval has
+        backed off to its maximum, a `ping` is sent as a fallback, in case the log
+        format doesn't carry the expected marker. Raises `MongodStartupError` if the
+        process exits or the configured start timeout passes.
+        """
+        watcher = self._log_watcher
+        delay = _READY_POLL_MIN
+        while True:
+            if self._check_startup(watcher, started_at):
+                return
+            if delay >= _READY_POLL_MAX and self.is_healthy:
+                return
+            wait_for_exit(self._proc, delay)
+            delay = min(delay * 2, _READY_POLL_MAX)
+
+    def _check_startup(self, watcher, started_at):
+        "Whether the readiness event is logged, raises if startup failed"
+        if watcher.saw_ready():
+            logger.debug("Found readiness event in mongod logs.")
+            return True
+        if self._proc.poll() is not None:
+            raise MongodStartupError(
+                "mongod exited with code {} during startup.{}".format(
+                    self._proc.returncode, self._logs_tail()
+                )
+            )
+        if time.monotonic() > started_at + self._pim_context.mongod_start_timeout:
+            self._proc.kill()
+            raise MongodStartupError(
+                "mongod didn't become ready in {} secs.{}".format(
+                    self._pim_context.mongod_start_timeout, self._logs_tail()
+                )
+            )
+        return False
+
+    def _shutdown(self):
+        """Ask mongod to shut down and wait for the process to exit. It is killed if
+        it is still running after `mongod_shutdown_timeout` seconds.
+        """
+        if self._adopted_pid is not None:
+            self._shutdown_adopted()
+            return
+        self._request_shutdown()
+        timeout = self._pim_context.mongod_shutdown_timeout
+        if wait_for_exit(self._proc, timeout) is None:
+            self._kill(timeout)
+        logger.info("Stopped mongod.")
+
+    def _request_shutdown(self):
+        "Send either the `shutdown` admin command or SIGTERM"
+        if self._pim_context.mongod_shutdown_method == "command":
+            logger.info("Sending shutdown command to mongod.")
+            try:
+                with self._shutdown_client() as client:
+                    client["admin"].command("shutdown", force=True)
+            except pymongo.errors.ConnectionFailure:
+                # Server closes the connection while shutting down.
+                pass
+            except pymongo.errors.PyMongoError as err:
+                logger.warning("Shutdown command failed, {}".format(err))
+                self._proc.terminate()
+        else:
+            logger.info("Sending terminate signal to mongod.")
+            self._proc.terminate()
+
+    def _kill(self, timeout):
+        logger.warning("mongod didn't shut down in {} secs, killing it.".format(timeout))
+        self._proc.kill()
+        self._proc.wait()
+
+    def _shutdown_adopted(self):
+        # Not a child process, so it can't be waited for, only polled.
+        pid, self._adopted_pid = self._adopted_pid, None
+        logger.info("Sending shutdown command to persistent mongod {}.".format(pid))
+        try:
+            with self._shutdown_client() as client:
+                client["admin"].command("shutdown", force=True)
+        except pymongo.errors.PyMongoError:
+            # Connection is closed while shutting down.
+            pass
+        deadline = time.monotonic() + self._pim_context.mongod_shutdown_timeout
+        while _pid_alive(pid) and time.monotonic() < deadline:
+            time.sleep(_READY_POLL_MAX)
+        if _pid_alive(pid):
+            logger.warning("Persistent mongod {} didn't shut down, killing.".format(pid))
+            os.kill(pid, signal.SIGKILL)
+        self._persistent.clear()
+
+    def _fingerprint(self):
+        "What a persistent daemon has to match to be reused"
+        return {
+            "url_hash": self._pim_context.url_hash,
+            "use_local_mongod": self._pim_context.use_local_mongod,
+            "profile": self.config.profile,
+            "extra_args": self._pim_context.mongod_extra_args,
+            "engine": self.config.engine,
+            "repl_set": self.config.repl_set,
+            "unix_socket": self.config.unix_socket is not None,
+            "local_address": self.config.local_address,
+            "auto_size": self._pim_context.auto_size,
+            "auto_size_instances": self._pim_context.auto_size_instances,
+        }
+
+    def _persistent_metadata(self):
+        return {
+            "pid": self._proc.pid,
+            "port": self.config.port,
+            "unix_socket": self.config.unix_socket,
+            "connection_string": self.connection_string,
+            "data_folder": self.data_folder,
+            "fingerprint": self._fingerprint(),
+        }
+
+    def _use_address(self, port, unix_socket):
+        "Connect to `port`, or `unix_socket` if it isn't `None`, from now on"
+        self.config.set_port(port)
+        self.config.unix_socket = unix_socket
+        self._connection_string = None
+        self._close_client()
+        self._client = self._make_client()
+
+    def _adopt(self):
+        """Connect to the daemon left running by a previous process, if it is healthy
+        and started with the same version and profile. A mismatching one is shut
+        down, and its data wiped.
+
+        Returns
+        -------
+        bool: Whether the daemon was adopted.
+        """
+        metadata = self._persistent.read()
+        if metadata is None:
+            return False
+        pid = metadata["pid"]
+        matches = metadata["fingerprint"] == self._fingerprint()
+        unix_socket = self.config.unix_socket
+
+        if _pid_alive(pid):
+            # Where the daemon listens, which may not be where a new one would.
+            self._use_address(metadata["port"], metadata.get("unix_socket"))
+            self.log_path = os.path.join(self.data_folder, "mongod.log")
+            if not self.is_healthy:
+                # The pid may have been reused by another process, leave it alone.
+                logger.warning(
+                    "Persistent mongod {} isn't responding, starting a new one.".format(
+                        pid
+                    )
+                )
+                self._use_address(None, unix_socket)
+            elif matches:
+                logger.info("Reusing persistent mongod {}".format(pid))
+                self._adopted_pid = pid
+                self.startup_duration = 0
+                return True
+            else:
+                logger.info(
+                    "Persistent mongod {} has another version or profile, "
+                    "restarting it.".format(pid)
+                )
+                self._adopted_pid = pid
+                self._shutdown()
+                self._use_address(None, unix_socket)
+
+        self._persistent.clear()
+        if not matches:
+            self._persistent.wipe_data()
+        return False
+
+    def _logs_tail(self, lines=10):
+        try:
+            tail = self.logs()[-lines:]
+        except OSError:
+            return ""
+        return "\nLast lines of the log:\n{}".format("".join(tail))
+
     def _clean_up(self):
         if self._using_tmp_folder:
             self._temp_data_folder.cleanup()
 
     def _check_lock(self):
+        if self._persistent is not None:
+            # Left behind by a persistent daemon that died, mongod recovers from it.
+            return
         while self.is_locked:
             if self._using_tmp_folder:
                 raise RuntimeError(
@@ -240,7 +1131,43 @@ class Mongod:
                     "Changing the data folder."
                 )
             )
-            self._temp_data_folder = TemporaryDirectory(prefix="pymongoim")
+            self._temp_data_folder = self._make_temp_data_folder()
+
+    def _make_temp_data_folder(self):
+        return TemporaryDirectory(prefix="pymongoim", dir=self._ram_disk_folder())
+
+    def _ram_disk_folder(self):
+        """RAM backed folder to keep the data in, if it should and can be used.
+
+        Storage engines other than ephemeralForTest write their data files to disk,
+        keeping them on a RAM disk, like `/dev/shm`, gives back the in-memory behaviour.
+        Falls back to the default temporary folder if there isn't a RAM disk with at
+        least `ram_disk_min_free_mb` free.
+        """
+        if (
+            not self._using_tmp_folder
+            or not self._pim_context.use_ram_disk
+            or self.config.engine == "ephemeralForTest"
+        ):
+            return None
+
+        folder = self._pim_context.ram_disk_folder
+        if not os.path.isdir(folder) or not os.access(folder, os.W_OK):
+            logger.info("RAM disk {} isn't available.".format(folder))
+            return None
+
+        free_mb = shutil.disk_usage(folder).free / 1024 / 1024
+        if free_mb < self._pim_context.ram_disk_min_free_mb:
+            logger.warning(
+                (
+                    "Only {:.0f} MiB free on RAM disk {}, "
+                    "falling back to the default temporary folder."
+                ).format(free_mb, folder)
+            )
+            return None
+
+        logger.debug("Keeping data on RAM disk {}".format(folder))
+        return folder
 
 
 if __name__ == "__main__":
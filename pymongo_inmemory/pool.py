@@ -0,0 +1,137 @@
+"""Warm pool of MongoDB daemons
+
+Starting a daemon is the biggest fixed cost of using an ephemeral MongoDB. A pool
+boots a number of daemons in the background and hands them out ready to use:
+::
+    with MongodPool(size=4) as pool:
+        with pool.mongod() as md:
+            client = pymongo.MongoClient(md.connection_string)
+"""
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import logging
+import queue
+import threading
+
+from .context import Context
+from .mongod import Mongod
+
+logger = logging.getLogger("PYMONGOIM_POOL")
+
+
+class MongodPool:
+    """Keeps `size` started `Mongod` instances ready. Handing one out doesn't wait for a
+    daemon to boot, as long as the pool can keep up. Every instance handed out is
+    replaced by a freshly started one in the background, and given back instances are
+    stopped in the background too. Instances are never reused.
+
+    All instances share the same `Context`, so it can't have a fixed `mongod_port` or
+    `mongod_data_folder`.
+    """
+
+    def __init__(self, size=None, pim_context: Context = None):
+        self._pim_context = Context() if pim_context is None else pim_context
+        if (
+            self._pim_context.mongod_port is not None
+            or self._pim_context.mongod_data_folder is not None
+        ):
+            raise ValueError(
+                "Pooled instances can't share a fixed port or data folder."
+            )
+
+        self.size = self._pim_context.pool_size if size is None else size
+        self._ready = queue.Queue()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.size, thread_name_prefix="pymongoim-pool"
+        )
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def start(self):
+        logger.info("Warming up {} instances.".format(self.size))
+        # Binary of the first instance is resolved right away, so that it is
+        # downloaded only once, before the rest are started in parallel.
+        first = self._new_mongod()
+        first.bin_folder
+        self._executor.submit(self._spawn, first)
+        for _ in range(self.size - 1):
+            self._executor.submit(self._spawn)
+
+    def acquire(self, timeout=None):
+        """Take a started instance out of the pool. Blocks until one is ready, for at
+        most `timeout` seconds. Raises `queue.Empty` on timeout, or the exception that
+        prevented the next instance from starting.
+        """
+        if self._closed:
+            raise RuntimeError("Pool is closed.")
+        item = self._ready.get(timeout=timeout)
+        with self._lock:
+            if not self._closed:
+                self._executor.submit(self._spawn)
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def release(self, md: Mongod):
+        """Stop an acquired instance in the background."""
+        with self._lock:
+            if not self._closed:
+                self._executor.submit(md.stop)
+                return
+        md.stop()
+
+    @contextmanager
+    def mongod(self, timeout=None):
+        md = self.acquire(timeout=timeout)
+        try:
+            yield md
+        finally:
+            self.release(md)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+        self._executor.shutdown(wait=True)
+        while True:
+            try:
+                item = self._ready.get_nowait()
+            except queue.Empty:
+                break
+            if not isinstance(item, Exception):
+                item.stop()
+        logger.info("Pool closed.")
+
+    @property
+    def available(self):
+        """Number of instances ready to be handed out."""
+        return self._ready.qsize()
+
+    def _new_mongod(self):
+        md = Mongod(self._pim_context)
+        md.config.fleet_size = self.size
+        return md
+
+    def _spawn(self, md=None):
+        try:
+            if md is None:
+                md = self._new_mongod()
+            md.start()
+        except Exception as err:
+            logger.error("Couldn't start a pooled instance: {}".format(err))
+            if md is not None:
+                md.stop()
+            self._ready.put(err)
+            return
+
+        with self._lock:
+            if not self._closed:
+                self._ready.put(md)
+                return
+        md.stop()
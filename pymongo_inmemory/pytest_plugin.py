@@ -0,0 +1,300 @@
+"""pytest plugin, registered through the `pytest11` entry point
+
+One MongoDB server is started for the whole session, the first time a test asks for
+it, and every test gets its own database on it:
+::
+    def test_insert(pim_db):
+        pim_db["users"].insert_one({"name": "someone"})
+
+Databases are dropped in the background after each test. Tests marked with
+`pim_fresh_server` get a server of their own instead. Server start and teardown times
+are summarised at the end of the session.
+
+Under pytest-xdist, coordination is opt-in, since the plugin is loaded in every
+project the package is installed in. Without `--pim-xdist-mode` each worker starts its
+own server when a test first asks for one. With it the controller downloads MongoDB
+once, before workers start, and the mode picks how workers get their server: `worker`
+starts one per worker on a port handed out by the controller, with the worker and its
+server pinned to a CPU. `shared` starts a single server on the controller that all
+workers use.
+
+Daemon modules are imported once a fixture needs them, so test runs that don't use
+the plugin don't get their SIGTERM handler either.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import itertools
+import logging
+import os
+import time
+
+import pymongo
+import pytest
+
+from ._utils import RESERVATION_SURVIVES_BIND, reserve_port
+from .context import Context
+
+logger = logging.getLogger("PYMONGOIM_PYTEST")
+
+FRESH_SERVER_MARK = "pim_fresh_server"
+XDIST_MODES = ("worker", "shared")
+
+
+class _Timings:
+    "Durations of server starts and teardowns in the session"
+
+    def __init__(self):
+        self.starts = []
+        self.stops = []
+
+    def start(self, md):
+        md.start()
+        self.starts.append(md.startup_duration)
+
+    def stop(self, md):
+        started_at = time.monotonic()
+        md.stop()
+        self.stops.append(time.monotonic() - started_at)
+
+    def merge(self, other):
+        self.starts += other["starts"]
+        self.stops += other["stops"]
+
+    def summary_lines(self):
+        lines = []
+        for name, durations in (("starts", self.starts), ("teardowns", self.stops)):
+            if durations:
+                lines.append(
+                    "{} server {}: {:.2f}s total, {:.2f}s max".format(
+                        len(durations), name, sum(durations), max(durations)
+                    )
+                )
+        return lines
+
+
+_timings = _Timings()
+_counter = itertools.count()
+
+
+def _unique_dbname(nodeid, worker="main"):
+    # Database names are limited to 63 characters and some punctuation, so the test
+    # id is hashed. Counter keeps reruns of the same test apart.
+    digest = hashlib.sha1(bytes(nodeid, "utf-8")).hexdigest()[:16]
+    return "pim_{}_{}_{}".format(worker, digest, next(_counter))
+
+
+def _worker_input(config):
+    return getattr(config, "workerinput", None)
+
+
+class _XdistController:
+    """Registered on the xdist controller only, xdist hooks are unknown without it.
+
+    Ports are reserved by the controller, so workers can't be handed the same port.
+    Where mongod can bind a reserved port, the reservations are held for the whole
+    session. Elsewhere they are released right away, which still leaves a much smaller
+    window for collisions than workers scanning for ports on their own.
+    """
+
+    def __init__(self, config):
+        from .downloader import download
+        from .mongod import Mongod
+
+        self.mode = config.getoption("pim_xdist_mode")
+        self.shared = None
+        self._reservations = []
+        self._cpus = sorted(os.sched_getaffinity(0)) if _can_pin() else []
+        self._next_cpu = 0
+
+        pim_context = Context()
+        if not pim_context.use_local_mongod:
+            download(pim_context)
+        if self.mode == "shared":
+            self.shared = Mongod(pim_context)
+            _timings.start(self.shared)
+
+    def pytest_configure_node(self, node):
+        if self.shared is not None:
+            node.workerinput["pim_connection_string"] = self.shared.connection_string
+            return
+        reservation = reserve_port(Context().mongod_port_range)
+        if RESERVATION_SURVIVES_BIND:
+            self._reservations.append(reservation)
+        else:
+            reservation.release()
+        node.workerinput["pim_port"] = reservation.port
+        if self._cpus:
+            cpu = self._cpus[self._next_cpu % len(self._cpus)]
+            self._next_cpu += 1
+            node.workerinput["pim_cpu"] = cpu
+
+    def pytest_testnodedown(self, node, error):
+        timings = getattr(node, "workeroutput", {}).get("pim_timings")
+        if timings is not None:
+            _timings.merge(timings)
+
+    def pytest_sessionfinish(self):
+        for reservation in self._reservations:
+            reservation.release()
+        if self.shared is not None:
+            _timings.stop(self.shared)
+            self.shared = None
+
+
+def _can_pin():
+    return hasattr(os, "sched_setaffinity")
+
+
+def pytest_addoption(parser):
+    parser.getgroup("pymongo_inmemory").addoption(
+        "--pim-xdist-mode",
+        dest="pim_xdist_mode",
+        choices=XDIST_MODES,
+        default=None,
+        help="With pytest-xdist, download MongoDB once and start a server per worker, "
+        "pinned to a CPU, or one shared by all workers. Off unless given.",
+    )
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        "markers",
+        "{}: run the test against a MongoDB server of its own".format(
+            FRESH_SERVER_MARK
+        ),
+    )
+    workerinput = _worker_input(config)
+    if workerinput is not None:
+        if "pim_cpu" in workerinput:
+            # Children inherit the affinity, so the worker's mongod shares its CPU.
+            os.sched_setaffinity(0, {workerinput["pim_cpu"]})
+    elif (
+        config.pluginmanager.hasplugin("dsession")
+        and config.getoption("pim_xdist_mode") is not None
+    ):
+        config.pluginmanager.register(
+            _XdistController(config), "pymongo_inmemory_xdist"
+        )
+
+
+@pytest.hookimpl(trylast=True)
+def pytest_sessionfinish(session):
+    # Runs after session fixtures are torn down, in time to send the timings back to
+    # the controller.
+    workeroutput = getattr(session.config, "workeroutput", None)
+    if workeroutput is not None:
+        workeroutput["pim_timings"] = {
+            "starts": _timings.starts,
+            "stops": _timings.stops,
+        }
+
+
+def pytest_terminal_summary(terminalreporter):
+    lines = _timings.summary_lines()
+    if lines:
+        terminalreporter.write_sep("-", "pymongo_inmemory")
+        for line in lines:
+            terminalreporter.write_line(line)
+
+
+@pytest.fixture(scope="session")
+def pim_mongod(request):
+    "MongoDB server shared by the session"
+    workerinput = _worker_input(request.config) or {}
+    if "pim_connection_string" in workerinput:
+        pytest.fail(
+            "pim_mongod isn't available with --pim-xdist-mode=shared, the server "
+            "belongs to the xdist controller. Use pim_client instead."
+        )
+    from .mongod import Mongod
+
+    pim_context = Context()
+    if "pim_port" in workerinput:
+        pim_context.mongod_port = workerinput["pim_port"]
+    md = Mongod(pim_context)
+    _timings.start(md)
+    yield md
+    _timings.stop(md)
+
+
+@pytest.fixture(scope="session")
+def _pim_connection_string(request):
+    workerinput = _worker_input(request.config) or {}
+    if "pim_connection_string" in workerinput:
+        return workerinput["pim_connection_string"]
+    return request.getfixturevalue("pim_mongod").connection_string
+
+
+@pytest.fixture(scope="session")
+def _pim_cleaner(_pim_connection_string):
+    # Drops databases of finished tests off the test's critical path. Created after
+    # the server, so that it is shut down, waiting for pending drops, before it.
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="pymongoim") as cleaner:
+        yield cleaner
+
+
+@pytest.fixture(scope="session")
+def pim_client(request, _pim_connection_string):
+    "`pymongo.MongoClient` connected to the shared server"
+    if "pim_connection_string" in (_worker_input(request.config) or {}):
+        with pymongo.MongoClient(_pim_connection_string) as client:
+            yield client
+    else:
+        # The server's own client, there is no need for a second connection pool.
+        yield request.getfixturevalue("pim_mongod").client
+
+
+@pytest.fixture
+def pim_dbname(request, monkeypatch):
+    """Database name unique to the test. It is set as `dbname` configuration for the
+    duration of the test, so `Context`s created by the test use it too.
+    """
+    workerinput = _worker_input(request.config) or {}
+    dbname = _unique_dbname(
+        request.node.nodeid, workerinput.get("workerid", "main")
+    )
+    monkeypatch.setenv("PYMONGOIM__DBNAME", dbname)
+    return dbname
+
+
+@pytest.fixture
+def pim_db(request, pim_dbname):
+    """Database of the test, on the shared server. For tests marked with
+    `pim_fresh_server` it is on a server of its own.
+    """
+    if request.node.get_closest_marker(FRESH_SERVER_MARK) is not None:
+        from .mongod import Mongod
+
+        md = Mongod(Context())
+        _timings.start(md)
+        try:
+            yield md.client[pim_dbname]
+        finally:
+            _timings.stop(md)
+        return
+
+    client = request.getfixturevalue("pim_client")
+    cleaner = request.getfixturevalue("_pim_cleaner")
+    yield client[pim_dbname]
+    cleaner.submit(client.drop_database, pim_dbname)
+
+
+@pytest.fixture(scope="session")
+def pim_replset_client():
+    "`MongoClient` of a single member replica set, shared by the session"
+    from ._pim import MongoClient
+
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv("PYMONGOIM__REPLICA_SET_MEMBERS", "1")
+        client = MongoClient()
+    yield client
+    client.close()
+
+
+@pytest.fixture
+def pim_transaction(pim_replset_client):
+    """Default database of `pim_replset_client`. The test runs in a transaction that
+    is aborted at teardown, so its writes are rolled back instead of dropped.
+    """
+    with pim_replset_client.pim_isolated():
+        yield pim_replset_client.get_default_database()
@@ -0,0 +1,150 @@
+"""Replica set of MongoDB daemons
+
+Transactions, change streams and retryable writes need a replica set. `ReplicaSet`
+launches its members, initiates the set and waits for a primary:
+::
+    with ReplicaSet(members=3) as rs:
+        client = pymongo.MongoClient(rs.connection_string)
+"""
+import logging
+import threading
+
+import pymongo
+from pymongo import monitoring
+
+from .context import Context
+from .mongod import Mongod, MongodStartupError, _start_concurrently, stop_many
+
+logger = logging.getLogger("PYMONGOIM_REPLSET")
+
+# Much shorter than the server defaults (10s and 2s), a local set doesn't have to
+# tolerate network hiccups.
+_ELECTION_TIMEOUT_MS = 500
+_HEARTBEAT_INTERVAL_MS = 200
+
+
+class _PrimaryListener(monitoring.TopologyListener):
+    "Sets `found` once the topology has a writable server"
+
+    def __init__(self):
+        self.found = threading.Event()
+
+    def opened(self, event):
+        pass
+
+    def description_changed(self, event):
+        if event.new_description.has_writable_server():
+            self.found.set()
+
+    def closed(self, event):
+        pass
+
+
+class ReplicaSet:
+    """Replica set of `members` daemons. The first member has the highest priority,
+    so it becomes the primary. It can be used in place of a `Mongod`.
+    """
+
+    def __init__(self, pim_context: Context = None, members=None, name=None):
+        self._pim_context = Context() if pim_context is None else pim_context
+        members = self._pim_context.replica_set_members if members is None else members
+        self.name = self._pim_context.replica_set_name if name is None else name
+        if members < 1:
+            raise ValueError("Replica set needs at least one member.")
+        if members > 1 and (
+            self._pim_context.mongod_port is not None
+            or self._pim_context.mongod_data_folder is not None
+        ):
+            raise ValueError("Replica set members can't share a port or data folder.")
+        if self._pim_context.use_unix_socket:
+            raise ValueError("Replica set members can't listen on unix sockets.")
+
+        self.mongods = [
+            Mongod(self._pim_context, on_disk=True) for _ in range(members)
+        ]
+        for md in self.mongods:
+            md.config.repl_set = self.name
+        self._initiated = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        _start_concurrently(self.mongods)
+        try:
+            if not self._initiated:
+                self._initiate()
+            self._wait_for_primary()
+        except Exception:
+            stop_many(self.mongods)
+            raise
+
+    def stop(self, clean_up=True):
+        if clean_up:
+            stop_many(self.mongods)
+        else:
+            for md in self.mongods:
+                md.stop(clean_up=False)
+
+    @property
+    def is_running(self):
+        return all(md.is_running for md in self.mongods)
+
+    @property
+    def hosts(self):
+        return [
+            "{}:{}".format(md.config.local_address, md.config.port)
+            for md in self.mongods
+        ]
+
+    @property
+    def connection_string(self):
+        dbname = self._pim_context.dbname or ""
+        return "mongodb://{hosts}/{dbname}?replicaSet={name}".format(
+            hosts=",".join(self.hosts), dbname=dbname, name=self.name
+        )
+
+    @property
+    def initiate_config(self):
+        return {
+            "_id": self.name,
+            "members": [
+                {"_id": index, "host": host, "priority": 2 if index == 0 else 1}
+                for index, host in enumerate(self.hosts)
+            ],
+            "settings": {
+                "electionTimeoutMillis": _ELECTION_TIMEOUT_MS,
+                "heartbeatIntervalMillis": _HEARTBEAT_INTERVAL_MS,
+            },
+        }
+
+    def mongodump(self, database, collection):
+        return self.mongods[0].mongodump(database, collection)
+
+    def _initiate(self):
+        logger.info("Initiating replica set {}".format(self.name))
+        with pymongo.MongoClient(self.hosts[0], directConnection=True) as client:
+            client["admin"].command("replSetInitiate", self.initiate_config)
+        self._initiated = True
+
+    def _wait_for_primary(self):
+        # Servers since 4.4 stream topology changes to the driver, so the listener
+        # hears about the election as it happens.
+        listener = _PrimaryListener()
+        timeout = self._pim_context.mongod_start_timeout
+        with pymongo.MongoClient(
+            self.connection_string,
+            event_listeners=[listener],
+            heartbeatFrequencyMS=500,
+        ):
+            if not listener.found.wait(timeout):
+                raise MongodStartupError(
+                    "Replica set {} has no primary after {} secs.".format(
+                        self.name, timeout
+                    )
+                )
+        logger.info("Replica set {} has a primary.".format(self.name))
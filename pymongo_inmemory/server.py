@@ -0,0 +1,325 @@
+"""Broker sharing MongoDB daemons between processes
+
+Every process starting its own daemon pays for resolving the binary and booting it.
+The broker is a long running process that owns the daemons, and leases databases, or
+whole daemons, to other processes:
+::
+    python -m pymongo_inmemory.server
+
+    broker = BrokerClient()
+    with broker.database() as lease:
+        client = pymongo.MongoClient(lease.connection_string)
+        db = client[lease.database]
+
+Requests and replies are JSON objects, one per line, over a unix socket, or TCP on
+localhost on Windows, see `broker_address`. Leases expire unless renewed. Expired
+databases are dropped, and expired daemons stopped, in the background.
+"""
+import argparse
+from contextlib import contextmanager
+from collections import namedtuple
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import threading
+import time
+import uuid
+
+from .context import Context
+from .mongod import Mongod
+from .pool import MongodPool
+
+logger = logging.getLogger("PYMONGOIM_SERVER")
+
+LEASE_DATABASE_PREFIX = "pimlease_"
+
+Lease = namedtuple("Lease", ["id", "connection_string", "database", "expires_in"])
+
+
+class BrokerError(RuntimeError):
+    pass
+
+
+def _parse_address(address):
+    """`host:port` for TCP, anything else is a unix socket path.
+
+    Returns
+    -------
+    tuple: Socket family and address.
+    """
+    host, _, port = address.rpartition(":")
+    if host and port.isdigit():
+        return socket.AF_INET, (host, int(port))
+    return socket.AF_UNIX, address
+
+
+class _Lease:
+    def __init__(self, ttl, database=None, mongod=None):
+        self.id = uuid.uuid4().hex
+        self.ttl = ttl
+        self.database = database
+        self.mongod = mongod
+        self.renew()
+
+    def renew(self):
+        self.expires_at = time.monotonic() + self.ttl
+
+    @property
+    def expired(self):
+        return time.monotonic() >= self.expires_at
+
+
+class Broker:
+    """Owns a shared daemon to lease databases on, and a pool of daemons to lease
+    whole. The pool is started on the first instance lease.
+    """
+
+    def __init__(self, pim_context: Context = None, lease_ttl=None):
+        self._pim_context = Context() if pim_context is None else pim_context
+        self.lease_ttl = (
+            self._pim_context.broker_lease_ttl if lease_ttl is None else lease_ttl
+        )
+        self._mongod = Mongod(self._pim_context)
+        self._pool = None
+        self._leases = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def start(self):
+        self._mongod.start()
+        threading.Thread(
+            target=self._reclaim_forever, name="pymongoim-reclaimer", daemon=True
+        ).start()
+
+    def stop(self):
+        self._stopped.set()
+        with self._lock:
+            leases, self._leases = list(self._leases.values()), {}
+        for lease in leases:
+            if lease.mongod is not None:
+                self._pool.release(lease.mongod)
+        if self._pool is not None:
+            self._pool.close()
+        self._mongod.stop()
+
+    def handle(self, request):
+        "Reply to a request, both are dicts"
+        op = request.get("op")
+        ttl = float(request.get("ttl") or self.lease_ttl)
+        if op == "lease_database":
+            database = LEASE_DATABASE_PREFIX + uuid.uuid4().hex[:16]
+            lease = _Lease(ttl, database=database)
+            connection_string = self._mongod.connection_string
+        elif op == "lease_instance":
+            timeout = self._pim_context.mongod_start_timeout
+            mongod = self._instance_pool().acquire(timeout)
+            lease = _Lease(ttl, database=self._pim_context.dbname, mongod=mongod)
+            connection_string = mongod.connection_string
+        elif op == "renew":
+            lease = self._lease(request)
+            lease.renew()
+            return {"ok": True, "expires_in": lease.ttl}
+        elif op == "release":
+            self._reclaim(self._lease(request, pop=True))
+            return {"ok": True}
+        elif op == "status":
+            with self._lock:
+                leases = len(self._leases)
+            return {"ok": True, "leases": leases}
+        else:
+            raise BrokerError("Unknown operation {}.".format(op))
+
+        with self._lock:
+            self._leases[lease.id] = lease
+        logger.info("Leased {} for {} secs.".format(lease.database, ttl))
+        return {
+            "ok": True,
+            "lease": lease.id,
+            "connection_string": connection_string,
+            "database": lease.database,
+            "expires_in": ttl,
+        }
+
+    def _lease(self, request, pop=False):
+        lease_id = request.get("lease")
+        with self._lock:
+            if pop:
+                lease = self._leases.pop(lease_id, None)
+            else:
+                lease = self._leases.get(lease_id)
+        if lease is None:
+            raise BrokerError("Unknown or expired lease {}.".format(lease_id))
+        return lease
+
+    def _instance_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = MongodPool(pim_context=self._pim_context)
+                self._pool.start()
+            return self._pool
+
+    def _reclaim(self, lease):
+        if lease.mongod is not None:
+            logger.info("Stopping leased instance {}".format(lease.id))
+            self._pool.release(lease.mongod)
+        else:
+            logger.info("Dropping leased database {}".format(lease.database))
+            self._mongod.client.drop_database(lease.database)
+
+    def _reclaim_forever(self):
+        interval = max(min(self.lease_ttl / 4, 30), 1)
+        while not self._stopped.wait(interval):
+            try:
+                self.reclaim()
+            except Exception:
+                logger.exception("Reclaiming leases failed.")
+
+    def reclaim(self):
+        """Reclaim expired leases, and drop lease databases without a lease, e.g.
+        left behind by a previous broker.
+        """
+        with self._lock:
+            expired = [lease for lease in self._leases.values() if lease.expired]
+            for lease in expired:
+                del self._leases[lease.id]
+        for lease in expired:
+            logger.info("Lease {} expired.".format(lease.id))
+            self._reclaim(lease)
+
+        # Listed before the leases are, so databases of new leases are never missed.
+        client = self._mongod.client
+        databases = client.list_database_names()
+        with self._lock:
+            leased = {lease.database for lease in self._leases.values()}
+        for database in databases:
+            if database.startswith(LEASE_DATABASE_PREFIX) and database not in leased:
+                logger.info("Dropping leaked database {}".format(database))
+                client.drop_database(database)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                reply = self.server.broker.handle(json.loads(line))
+            except Exception as e:
+                logger.debug("Request failed", exc_info=True)
+                reply = {"ok": False, "error": str(e)}
+            self.wfile.write(bytes(json.dumps(reply) + "\n", "utf-8"))
+
+
+def _make_server(address, broker):
+    family, address = _parse_address(address)
+    if family == socket.AF_UNIX:
+        if os.path.exists(address):
+            with socket.socket(family, socket.SOCK_STREAM) as soc:
+                if soc.connect_ex(address) == 0:
+                    raise BrokerError("A broker is running on {}".format(address))
+            # Left behind by a broker that didn't shut down cleanly.
+            os.remove(address)
+        server = socketserver.ThreadingUnixStreamServer(address, _RequestHandler)
+    else:
+        server = socketserver.ThreadingTCPServer(address, _RequestHandler)
+    server.daemon_threads = True
+    server.broker = broker
+    return server
+
+
+class BrokerClient:
+    """Leases databases and daemons from a broker running at `address`."""
+
+    def __init__(self, address=None, pim_context: Context = None):
+        if address is None:
+            pim_context = Context() if pim_context is None else pim_context
+            address = pim_context.broker_address
+        self.address = address
+
+    def request(self, op, **kwargs):
+        family, address = _parse_address(self.address)
+        with socket.socket(family, socket.SOCK_STREAM) as soc:
+            soc.connect(address)
+            with soc.makefile("rwb") as f:
+                f.write(bytes(json.dumps(dict(kwargs, op=op)) + "\n", "utf-8"))
+                f.flush()
+                reply = json.loads(f.readline())
+        if not reply["ok"]:
+            raise BrokerError(reply["error"])
+        return reply
+
+    def lease_database(self, ttl=None):
+        return self._lease("lease_database", ttl)
+
+    def lease_instance(self, ttl=None):
+        return self._lease("lease_instance", ttl)
+
+    def renew(self, lease: Lease):
+        return self.request("renew", lease=lease.id)["expires_in"]
+
+    def release(self, lease: Lease):
+        self.request("release", lease=lease.id)
+
+    @contextmanager
+    def database(self, ttl=None):
+        "A leased database, released at the end of the block"
+        lease = self.lease_database(ttl)
+        try:
+            yield lease
+        finally:
+            self.release(lease)
+
+    @contextmanager
+    def instance(self, ttl=None):
+        "A leased daemon, released at the end of the block"
+        lease = self.lease_instance(ttl)
+        try:
+            yield lease
+        finally:
+            self.release(lease)
+
+    def _lease(self, op, ttl):
+        reply = self.request(op, ttl=ttl)
+        return Lease(
+            reply["lease"],
+            reply["connection_string"],
+            reply["database"],
+            reply["expires_in"],
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m pymongo_inmemory.server", description=__doc__.split("\n")[0]
+    )
+    parser.add_argument("--address", help="Unix socket path or host:port to listen on.")
+    parser.add_argument(
+        "--lease-ttl", type=float, help="Seconds a lease lasts without renewal."
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    pim_context = Context()
+    broker = Broker(pim_context, args.lease_ttl)
+    broker.start()
+    server = _make_server(args.address or pim_context.broker_address, broker)
+    # serve_forever has to be stopped from another thread.
+    signal.signal(
+        signal.SIGTERM,
+        lambda *args: threading.Thread(target=server.shutdown).start(),
+    )
+    logger.info("Broker listening on {}".format(server.server_address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if server.address_family == socket.AF_UNIX:
+            os.remove(server.server_address)
+        broker.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""Prebuilt data folders
+
+Seeding a database, and building its indexes, can take longer than the tests using it.
+A template is a data folder seeded once and kept in the cache folder, next to the
+downloaded binaries. Daemons boot from a cheap clone of it:
+::
+    def seed(client):
+        client.get_default_database()["users"].create_index("email")
+
+    cache = TemplateCache()
+    with cache.mongod(seed, fixtures=["tests/fixtures/users.json"]) as md:
+        ...
+
+Templates are keyed by the MongoDB version, the source of the seeding function and
+the contents of the fixture files, so changing any of them builds a new template.
+
+`TemplateDatabase` does the same within a running server, a seeded database is copied
+into a fresh one per test, without the documents leaving the server:
+::
+    template = TemplateDatabase(client).seed(seed)
+    db = template.clone("test_users")
+"""
+import hashlib
+import inspect
+import logging
+import os
+from os import path
+import shutil
+from tempfile import mkdtemp
+
+import pymongo
+
+from ._utils import clone_tree
+from .context import Context
+from .mongod import Mongod, _SNAPSHOT_IGNORE
+
+logger = logging.getLogger("PYMONGOIM_TEMPLATES")
+
+_ARCHIVE_FORMAT = "gztar"
+_ARCHIVE_SUFFIX = ".tar.gz"
+
+# Collections staged in the template database, for servers whose `$out` can't write
+# to another database.
+_STAGING_PREFIX = "pim_staging."
+
+
+def _seed_source(seed):
+    try:
+        return inspect.getsource(seed)
+    except (OSError, TypeError):
+        return "{}.{}".format(seed.__module__, seed.__qualname__)
+
+
+def _fixture_files(fixtures):
+    for fixture in sorted(fixtures):
+        if path.isdir(fixture):
+            for root, dirs, files in os.walk(fixture):
+                dirs.sort()
+                for name in sorted(files):
+                    yield path.join(root, name)
+        else:
+            yield fixture
+
+
+class TemplateCache:
+    """Cache of seeded data folders, stored under `template_folder`."""
+
+    def __init__(self, pim_context: Context = None):
+        self._pim_context = Context() if pim_context is None else pim_context
+        self.folder = self._pim_context.template_folder
+
+    def key(self, seed, fixtures=()):
+        hasher = hashlib.sha256()
+        hasher.update(bytes(self._pim_context.url_hash, "utf-8"))
+        hasher.update(bytes(_seed_source(seed), "utf-8"))
+        for fixture in _fixture_files(fixtures):
+            hasher.update(bytes(path.relpath(fixture), "utf-8"))
+            with open(fixture, "rb") as f:
+                hasher.update(f.read())
+        return hasher.hexdigest()
+
+    def path(self, key):
+        return path.join(self.folder, key)
+
+    def get(self, seed, fixtures=()):
+        """Path of the template for `seed` and `fixtures`, built if it isn't cached.
+
+        Parameters
+        ----------
+        seed: callable
+            Called with a `pymongo.MongoClient`, whose default database is `dbname`.
+        fixtures: list of str
+            Files or folders the seeding function reads.
+        """
+        key = self.key(seed, fixtures)
+        template_path = self.path(key)
+        if path.isdir(template_path):
+            logger.debug("Found template {}".format(key))
+            return template_path
+        self._build(key, seed)
+        return template_path
+
+    def mongod(self, seed, fixtures=()):
+        """A `Mongod` that boots from a clone of the template."""
+        return Mongod(self._pim_context, template=self.get(seed, fixtures))
+
+    def export(self, key, archive_folder):
+        """Archive a template, e.g. to store it in a CI cache.
+
+        Returns
+        -------
+        str: Path of the archive.
+        """
+        return shutil.make_archive(
+            path.join(archive_folder, key), _ARCHIVE_FORMAT, root_dir=self.path(key)
+        )
+
+    def import_archive(self, archive_file):
+        """Add a template from an archive created by `export`.
+
+        Returns
+        -------
+        str: Key of the template.
+        """
+        key = path.basename(archive_file)[: -len(_ARCHIVE_SUFFIX)]
+        if not path.isdir(self.path(key)):
+            self._publish(
+                key,
+                lambda staging: shutil.unpack_archive(
+                    archive_file, staging, _ARCHIVE_FORMAT
+                ),
+            )
+        return key
+
+    def _build(self, key, seed):
+        logger.info("Building template {}".format(key))
+        md = Mongod(self._pim_context, on_disk=True)
+        md.start()
+        try:
+            seed(md.client)
+            md.stop(clean_up=False)
+            self._publish(
+                key,
+                lambda staging: clone_tree(
+                    md.data_folder, staging, ignore=_SNAPSHOT_IGNORE
+                ),
+            )
+        finally:
+            md.stop()
+
+    def _publish(self, key, fill):
+        # Templates are filled in a staging folder and renamed into place, which is
+        # atomic, so concurrent builds never see a partial template. The loser of a
+        # race just discards its copy.
+        staging = mkdtemp(prefix=".staging-", dir=self.folder)
+        try:
+            fill(staging)
+            os.rename(staging, self.path(key))
+        except OSError:
+            if not path.isdir(self.path(key)):
+                raise
+            logger.debug("Template {} was built concurrently.".format(key))
+        finally:
+            if path.isdir(staging):
+                shutil.rmtree(staging)
+
+
+class TemplateDatabase:
+    """Seeded database inside a running server, to clone databases from.
+
+    Collections are copied with `$out` aggregations, so documents never travel
+    through Python. Collection options and indexes are created before the copy,
+    views are recreated from their definitions.
+    """
+
+    def __init__(self, client: pymongo.MongoClient, name="pimtemplate"):
+        self._client = client
+        self.name = name
+        self._out_across_databases = None
+
+    @property
+    def database(self):
+        return self._client[self.name]
+
+    def seed(self, seed):
+        """Call `seed` with the template database if it doesn't exist yet.
+
+        Returns
+        -------
+        TemplateDatabase: self
+        """
+        if self.name not in self._client.list_database_names():
+            logger.info("Seeding template database {}".format(self.name))
+            seed(self.database)
+        return self
+
+    def clone(self, target):
+        """Copy the template database into `target`, which is dropped first.
+
+        Returns
+        -------
+        pymongo.database.Database: The copy.
+        """
+        self._client.drop_database(target)
+        views = []
+        for info in self.database.list_collections():
+            name = info["name"]
+            if name.startswith("system.") or name.startswith(_STAGING_PREFIX):
+                continue
+            if info.get("type") == "view":
+                views.append(info)
+            else:
+                self._clone_collection(name, info.get("options", {}), target)
+        for info in views:
+            self._client[target].command("create", info["name"], **info["options"])
+        return self._client[target]
+
+    def drop(self):
+        self._client.drop_database(self.name)
+
+    def _clone_collection(self, name, options, target):
+        if self._supports_out_across_databases():
+            self._prepare(self._client[target], name, name, options)
+            self._copy(name, {"db": target, "coll": name})
+            return
+
+        # `renameCollection` across databases keeps options and indexes, so the
+        # collection is staged in the template database and moved.
+        staging = "{}{}.{}".format(_STAGING_PREFIX, target, name)
+        self._prepare(self.database, name, staging, options)
+        self._copy(name, staging)
+        self._client["admin"].command(
+            "renameCollection",
+            "{}.{}".format(self.name, staging),
+            to="{}.{}".format(target, name),
+            dropTarget=True,
+        )
+
+    def _prepare(self, database, source, name, options):
+        "Create the collection with the options and indexes of `source`"
+        database.command("create", name, **options)
+        indexes = [
+            {k: v for k, v in index.items() if k not in ("v", "ns")}
+            for index in self.database[source].list_indexes()
+            if index["name"] != "_id_"
+        ]
+        if indexes:
+            database.command("createIndexes", name, indexes=indexes)
+
+    def _copy(self, source, out):
+        # `$out` into an existing collection keeps its options and indexes.
+        self.database.command(
+            "aggregate", source, pipeline=[{"$out": out}], cursor={}
+        )
+
+    def _supports_out_across_databases(self):
+        if self._out_across_databases is None:
+            version = self._client.server_info()["versionArray"]
+            self._out_across_databases = tuple(version[:2]) >= (4, 4)
+        return self._out_across_databases
@@ -0,0 +1,205 @@
+"""Undo writes through the oplog
+
+For tests whose writes can't run in a transaction, `OplogUndo` rolls a replica set
+back to a mark by inverting the oplog entries written after it:
+::
+    undo = OplogUndo(client)
+    undo.mark()
+    ...
+    undo.undo()
+
+Inserts are deleted, updated and deleted documents are restored from their pre-images,
+collections and indexes created after the mark are dropped. Pre-images are recorded by
+enabling `changeStreamPreAndPostImages` on the collections, which needs MongoDB 6.0.
+Operations that can't be inverted, like dropping a collection that existed at the mark,
+raise `UndoError` before anything is changed.
+"""
+import logging
+
+import pymongo
+
+logger = logging.getLogger("PYMONGOIM_UNDO")
+
+_SYSTEM_DATABASES = ("admin", "config", "local")
+# Commands of index builds that don't change anything until they are committed.
+_IGNORED_COMMANDS = ("startIndexBuild", "abortIndexBuild")
+
+
+class UndoError(RuntimeError):
+    pass
+
+
+def _split_namespace(namespace):
+    database, _, collection = namespace.partition(".")
+    return database, collection
+
+
+def _created_collections(entries):
+    "Namespaces of collections created, or renamed from created ones, in `entries`"
+    created = set()
+    for entry, _ in entries:
+        if entry["op"] != "c":
+            continue
+        command = entry["o"]
+        if "create" in command:
+            database, _ = _split_namespace(entry["ns"])
+            created.add("{}.{}".format(database, command["create"]))
+        elif command.get("renameCollection") in created:
+            created.add(command["to"])
+    return created
+
+
+class OplogUndo:
+    """Rolls back writes made on the replica set `client` is connected to, since the
+    last call to `mark`.
+    """
+
+    def __init__(self, client: pymongo.MongoClient):
+        self._client = client
+        self._mark = None
+
+    def mark(self):
+        """Enable pre-images on all collections and remember the oplog position.
+
+        Returns
+        -------
+        bson.Timestamp: Position of the mark.
+        """
+        for database in self._client.list_database_names():
+            if database in _SYSTEM_DATABASES:
+                continue
+            for info in self._client[database].list_collections(
+                filter={"type": "collection"}
+            ):
+                options = info.get("options", {})
+                enabled = options.get("changeStreamPreAndPostImages", {})
+                if info["name"].startswith("system.") or enabled.get("enabled"):
+                    continue
+                self._client[database].command(
+                    "collMod",
+                    info["name"],
+                    changeStreamPreAndPostImages={"enabled": True},
+                )
+        # Taken after collMod, so enabling pre-images isn't undone.
+        self._mark = self._latest_ts()
+        logger.debug("Marked oplog at {}".format(self._mark))
+        return self._mark
+
+    def undo(self):
+        """Invert the oplog entries written since the mark, newest first, and mark
+        again. Raises `UndoError` without changing anything if an entry can't be
+        inverted.
+        """
+        if self._mark is None:
+            raise UndoError("Nothing to undo to, call mark first.")
+        entries = list(self._entries())
+        created = _created_collections(entries)
+        actions = [
+            action
+            for entry, index in reversed(entries)
+            for action in self._invert(entry, index, created)
+        ]
+        logger.info(
+            "Undoing {} oplog entries with {} actions.".format(
+                len(entries), len(actions)
+            )
+        )
+        for action in actions:
+            action()
+        for namespace in sorted(created):
+            database, collection = _split_namespace(namespace)
+            self._client[database].drop_collection(collection)
+        self.mark()
+
+    def _latest_ts(self):
+        latest = (
+            self._client["local"]["oplog.rs"]
+            .find({}, {"ts": 1})
+            .sort("$natural", pymongo.DESCENDING)
+            .limit(1)
+        )
+        for entry in latest:
+            return entry["ts"]
+        raise UndoError("Oplog is empty, is the server a replica set member?")
+
+    def _entries(self):
+        "Oplog entries after the mark, with the entries of `applyOps` unpacked"
+        oplog = self._client["local"]["oplog.rs"].find({"ts": {"$gt": self._mark}})
+        for entry in oplog.sort("$natural", pymongo.ASCENDING):
+            if entry["op"] == "c" and "applyOps" in entry["o"]:
+                for index, inner in enumerate(entry["o"]["applyOps"]):
+                    inner = dict(inner, ts=entry["ts"])
+                    if self._is_user_namespace(inner):
+                        yield inner, index
+            elif self._is_user_namespace(entry):
+                yield entry, 0
+
+    @staticmethod
+    def _is_user_namespace(entry):
+        database, _ = _split_namespace(entry.get("ns", ""))
+        return entry["op"] != "n" and database and database not in _SYSTEM_DATABASES
+
+    def _invert(self, entry, index, created):
+        """Actions undoing `entry`. Nothing to do for collections created after the
+        mark, they are dropped at the end.
+        """
+        op, namespace = entry["op"], entry["ns"]
+        database, collection = _split_namespace(namespace)
+        if op == "c":
+            return self._invert_command(database, entry, created)
+        if namespace in created:
+            return []
+
+        coll = self._client[database][collection]
+        if op == "i":
+            _id = entry["o"]["_id"]
+            return [lambda: coll.delete_one({"_id": _id})]
+
+        if op in ("u", "d"):
+            pre_image = self._pre_image(entry, index)
+            query = {"_id": pre_image["_id"]}
+            return [lambda: coll.replace_one(query, pre_image, upsert=True)]
+        raise UndoError("Can't undo {} operation on {}.".format(op, namespace))
+
+    def _invert_command(self, database, entry, created):
+        command = entry["o"]
+        name = next(iter(command))
+        if name == "create" or name in _IGNORED_COMMANDS:
+            return []
+        admin = self._client["admin"]
+        if name == "renameCollection" and not command.get("dropTarget"):
+            # Names are full namespaces here.
+            source, renamed = command[name], command["to"]
+            if source in created:
+                return []
+            return [lambda: admin.command("renameCollection", renamed, to=source)]
+
+        target = "{}.{}".format(database, command[name])
+        if target in created:
+            return []
+        db = self._client[database]
+        if name == "createIndexes":
+            index_name = command["name"]
+            return [lambda: db[command[name]].drop_index(index_name)]
+        if name == "commitIndexBuild":
+            index_names = [index["name"] for index in command["indexes"]]
+            return [
+                lambda: db.command("dropIndexes", command[name], index=index_names)
+            ]
+        raise UndoError("Can't undo {} command on {}.".format(name, target))
+
+    def _pre_image(self, entry, index):
+        pre_image = self._client["config"]["system.preimages"].find_one(
+            {
+                "_id.nsUUID": entry["ui"],
+                "_id.ts": entry["ts"],
+                "_id.applyOpsIndex": index,
+            }
+        )
+        if pre_image is None:
+            raise UndoError(
+                "No pre-image for {} operation on {} at {}.".format(
+                    entry["op"], entry["ns"], entry["ts"]
+                )
+            )
+        return pre_image["preImage"]
@@ -21,5 +21,9 @@ def server(request):
     return server
 
 
-def test_find_open_port(server):
-    assert _utils.find_open_port([12323, 12324]) == 12324
+def test_reserve_port(server):
+    reservation = _utils.reserve_port(range(12323, 12325))
+    try:
+        assert reservation.port == 12324
+    finally:
+        reservation.release()
@@ -0,0 +1,40 @@
+import subprocess
+
+import pytest
+
+from pymongo_inmemory import mongod
+
+
+class Popen:
+    "mongod process that runs until it is terminated"
+
+    def __init__(self, cmd):
+        self.cmd = cmd
+        self.pid = -1
+        self.terminated = False
+        self.returncode = None
+
+    def terminate(self):
+        self.terminated = True
+        self.returncode = 0
+
+    def kill(self):
+        self.terminate()
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self, timeout=None):
+        if self.returncode is None:
+            raise subprocess.TimeoutExpired(self.cmd, timeout)
+        return self.returncode
+
+
+@pytest.fixture
+def fake_mongod(monkeypatch):
+    """Daemons are `Popen` fakes, healthy once started, and no binary is downloaded.
+    Tests patch `subprocess.Popen` again for other fakes.
+    """
+    monkeypatch.setattr(subprocess, "Popen", Popen)
+    monkeypatch.setattr(mongod.Mongod, "is_healthy", True)
+    monkeypatch.setattr(mongod, "download", lambda pim_context: "")
@@ -1,7 +1,12 @@
 import asyncio
+import os
+import subprocess
 import threading
 import sys
 
+from pymongo_inmemory import _utils
+from pymongo_inmemory._async import AsyncMongod
+
 
 def test_init_module_in_loop():
     sys.modules.pop("pymongo_inmemory.mongod", None)
@@ -19,3 +24,55 @@ def test_init_module_in_loop():
     thread.join()
 
     assert result
+
+
+def test_async_mongod_start_and_stop(monkeypatch, fake_mongod):
+    async def main():
+        mongods = [AsyncMongod(None) for _ in range(3)]
+        await asyncio.gather(*(md.start() for md in mongods))
+        assert all(md.is_running for md in mongods)
+        assert len({md.config.port for md in mongods}) == 3
+        await asyncio.gather(*(md.stop() for md in mongods))
+        return mongods
+
+    mongods = asyncio.run(main())
+    assert all(md._proc.terminated for md in mongods)
+    assert not any(os.path.exists(md.data_folder) for md in mongods)
+
+
+class StatusClient:
+    def __getitem__(self, name):
+        return self
+
+    def command(self, name, **kwargs):
+        cache = {"pages read into cache": 1200}
+        return {"wiredTiger": {"cache": cache}}
+
+    def close(self):
+        pass
+
+
+def test_async_mongod_reports_cache(monkeypatch, fake_mongod):
+    monkeypatch.setenv("PYMONGOIM__MONGOD_PROFILE", "constrained")
+
+    async def main():
+        async with AsyncMongod(None) as md:
+            md._client = StatusClient()
+        return md
+
+    md = asyncio.run(main())
+    assert md.cache_report["pages_read"] == 1200
+
+
+def test_async_wait_for_exit():
+    async def main():
+        proc = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+        try:
+            assert await _utils.async_wait_for_exit(proc, 0.01) is None
+            proc.terminate()
+            assert await _utils.async_wait_for_exit(proc, 10) is not None
+        finally:
+            proc.kill()
+            proc.wait()
+
+    asyncio.run(main())
@@ -0,0 +1,25 @@
+
+from pymongo_inmemory import cluster, replset
+
+
+def test_cluster_components(monkeypatch, fake_mongod):
+    monkeypatch.setattr(replset.ReplicaSet, "_initiate", lambda self: None)
+    monkeypatch.setattr(replset.ReplicaSet, "_wait_for_primary", lambda self: None)
+    monkeypatch.setattr(cluster.ShardedCluster, "_add_shards", lambda self: None)
+
+    with cluster.ShardedCluster(shards=2, shard_members=2) as sharded:
+        assert sharded.is_running
+        assert len(sharded.shards) == 2
+        for md in sharded.config_servers.mongods:
+            assert "--configsvr" in md._proc.cmd
+        for shard in sharded.shards:
+            assert len(shard.mongods) == 2
+            for md in shard.mongods:
+                assert "--shardsvr" in md._proc.cmd
+
+        mongos_cmd = sharded.mongos._proc.cmd
+        assert mongos_cmd[0].endswith("mongos")
+        configdb = mongos_cmd[mongos_cmd.index("--configdb") + 1]
+        assert configdb == "pimconfig/" + ",".join(sharded.config_servers.hosts)
+        assert sharded.connection_string == sharded.mongos.connection_string
+    assert not sharded.is_running
@@ -64,3 +64,14 @@ def test_type_coercion_uncoercible_values(monkeypatch):
     assert not pim_context.ignore_cache
     assert not pim_context.use_local_mongod
     assert pim_context.mongod_port is None
+
+
+def test_port_range_config(monkeypatch):
+    monkeypatch.setenv("PYMONGOIM__MONGOD_PORT_RANGE", "30000-30010")
+    pim_context = context.Context()
+    assert pim_context.mongod_port_range == range(30000, 30011)
+
+
+def test_boolean_defaults_are_kept():
+    assert context.conf("some_flag", True, coerce_with=bool) is True
+    assert context.conf("some_flag", False, coerce_with=bool) is False
@@ -1,56 +1,474 @@
+import os
 import subprocess
 
-from pymongo_inmemory.mongod import Mongod
-import pymongo_inmemory.downloader as downloader
+import pymongo
+import pytest
 
+from pymongo_inmemory import mongod
+from pymongo_inmemory.mongod import Mongod, MongodStartupError
+from conftest import Popen
 
-class Popen:
-    def __init__(self, cmd):
-        self.cmd = cmd
-        self.terminated = False
+
+class StubbornPopen(Popen):
+    """Ignores SIGTERM"""
 
     def terminate(self):
         self.terminated = True
 
-    def poll(self):
-        return True
-
-
-def returns_true():
-    return True
+    def kill(self):
+        self.returncode = -9
 
 
-def download():
-    return ""
-
+class CrashingPopen(Popen):
+    def __init__(self, cmd):
+        super().__init__(cmd)
+        self.returncode = 14
 
-def test_mongod_data_folder_config(monkeypatch):
-    monkeypatch.setattr(subprocess, "Popen", Popen)
-    monkeypatch.setattr(Mongod, "is_healthy", returns_true)
-    monkeypatch.setattr(downloader, "download", download)
 
+def test_mongod_data_folder_config(monkeypatch, fake_mongod):
     monkeypatch.setenv("PYMONGOIM__MONGOD_DATA_FOLDER", "TEST")
 
     with Mongod(None) as md:
         assert md.data_folder == "TEST"
 
 
-def test_dbname_config(monkeypatch):
-    monkeypatch.setattr(subprocess, "Popen", Popen)
-    monkeypatch.setattr(Mongod, "is_healthy", returns_true)
-    monkeypatch.setattr(downloader, "download", download)
-
+def test_dbname_config(monkeypatch, fake_mongod):
     monkeypatch.setenv("PYMONGOIM__DBNAME", "TEST")
 
     with Mongod(None) as md:
         assert md.config.connection_string.endswith("TEST")
 
 
-def test_mongo_client_host_config(monkeypatch):
-    monkeypatch.setattr(subprocess, "Popen", Popen)
-    monkeypatch.setattr(Mongod, "is_healthy", returns_true)
-    monkeypatch.setattr(downloader, "download", download)
+def test_mongo_client_host_config(monkeypatch, fake_mongod):
     monkeypatch.setenv("PYMONGOIM__MONGO_CLIENT_HOST", "mongodb://test")
 
     with Mongod(None) as md:
         assert md.config.connection_string == "mongodb://test"
+
+
+def test_startup_fails_fast_if_mongod_exits(monkeypatch, fake_mongod):
+    monkeypatch.setattr(subprocess, "Popen", CrashingPopen)
+
+    md = Mongod(None)
+    with pytest.raises(MongodStartupError):
+        md.start()
+
+
+def test_log_watcher_finds_readiness_event(tmpdir):
+    log_path = tmpdir / "mongod.log"
+    watcher = mongod._LogWatcher(str(log_path))
+    assert not watcher.saw_ready()
+
+    with open(log_path, "a") as logfile:
+        logfile.write('{"t":{},"msg":"Waiting for conn')
+    assert not watcher.saw_ready()
+
+    with open(log_path, "a") as logfile:
+        logfile.write('ections","attr":{"port":27017}}\n')
+    assert watcher.saw_ready()
+
+
+def test_log_watcher_skips_stale_log(tmpdir):
+    log_path = tmpdir / "mongod.log"
+    log_path.write("Waiting for connections\n")
+    watcher = mongod._LogWatcher(str(log_path))
+    assert not watcher.saw_ready()
+
+    # Appended to with --logappend.
+    with open(log_path, "a") as logfile:
+        logfile.write("Starting\n")
+    assert not watcher.saw_ready()
+
+    # Rotated at startup.
+    os.rename(log_path, tmpdir / "mongod.log.old")
+    log_path.write("Waiting for connections\n")
+    assert watcher.saw_ready()
+
+
+def test_stale_log_is_not_taken_for_readiness(monkeypatch, fake_mongod, tmpdir):
+    monkeypatch.setattr(Mongod, "is_healthy", False)
+    monkeypatch.setenv("PYMONGOIM__MONGOD_DATA_FOLDER", str(tmpdir))
+    monkeypatch.setenv("PYMONGOIM__MONGOD_START_TIMEOUT", "0.2")
+    (tmpdir / "mongod.log").write("Waiting for connections\n")
+
+    md = Mongod(None)
+    with pytest.raises(MongodStartupError):
+        md.start()
+
+
+def test_stop_escalates_to_kill(monkeypatch, fake_mongod):
+    monkeypatch.setattr(subprocess, "Popen", StubbornPopen)
+    monkeypatch.setenv("PYMONGOIM__MONGOD_SHUTDOWN_TIMEOUT", "0")
+
+    with Mongod(None) as md:
+        proc = md._proc
+
+    assert proc.terminated
+    assert proc.returncode == -9
+
+
+def test_port_is_resolved_once(monkeypatch, fake_mongod):
+    with Mongod(None) as md:
+        assert md.config.port == md.config.port
+        assert ":{}/".format(md.config.port) in md.connection_string
+        assert md._proc.cmd[md._proc.cmd.index("--port") + 1] == md.config.port
+
+
+class AdminClient:
+    def __init__(self):
+        self.commands = []
+
+    def __getitem__(self, name):
+        return self
+
+    def command(self, name, **kwargs):
+        self.commands.append(name)
+
+    def close(self):
+        pass
+
+
+def test_client_is_closed_before_shutdown(monkeypatch, fake_mongod):
+    calls = []
+
+    class ClosingClient(AdminClient):
+        def close(self):
+            calls.append("close")
+
+    class RecordingPopen(Popen):
+        def terminate(self):
+            calls.append("terminate")
+            super().terminate()
+
+    monkeypatch.setattr(subprocess, "Popen", RecordingPopen)
+    with Mongod(None) as md:
+        md._client = ClosingClient()
+    assert calls == ["close", "terminate"]
+
+
+def test_snapshot_and_restore(monkeypatch, fake_mongod):
+    monkeypatch.setenv("PYMONGOIM__STORAGE_ENGINE", "wiredTiger")
+
+    with Mongod(None) as md:
+        md._client = AdminClient()
+        collection_file = os.path.join(md.data_folder, "collection-0.wt")
+        with open(collection_file, "w") as f:
+            f.write("seeded")
+
+        snapshot = md.snapshot()
+        assert md._client.commands == ["fsync", "fsyncUnlock"]
+        assert not os.path.exists(os.path.join(snapshot.path, "mongod.log"))
+
+        with open(collection_file, "w") as f:
+            f.write("changed")
+        with open(os.path.join(md.data_folder, "collection-1.wt"), "w") as f:
+            f.write("new")
+
+        md.restore(snapshot)
+        assert md.is_running
+        # Restarted with a client of its own, the fake is closed.
+        assert isinstance(md.client, pymongo.MongoClient)
+        assert not md.client._closed
+        with open(collection_file) as f:
+            assert f.read() == "seeded"
+        assert not os.path.exists(os.path.join(md.data_folder, "collection-1.wt"))
+        snapshot.discard()
+
+
+def test_boot_from_template(monkeypatch, fake_mongod, tmpdir):
+    tmpdir.join("collection-0.wt").write("seeded")
+
+    with Mongod(None, template=str(tmpdir)) as md:
+        assert md.config.engine == "wiredTiger"
+        assert os.path.isfile(os.path.join(md.data_folder, "collection-0.wt"))
+
+
+def test_template_is_not_merged_into_data(monkeypatch, fake_mongod, tmpdir):
+    template = tmpdir.mkdir("template")
+    template.join("collection-0.wt").write("seeded")
+    data_folder = tmpdir.mkdir("data")
+    data_folder.join("collection-1.wt").write("data")
+    monkeypatch.setenv("PYMONGOIM__MONGOD_DATA_FOLDER", str(data_folder))
+
+    with pytest.raises(ValueError):
+        Mongod(None, template=str(template)).start()
+    assert data_folder.listdir() == [data_folder.join("collection-1.wt")]
+
+
+def test_data_folder_on_ram_disk(monkeypatch, fake_mongod, tmpdir):
+    monkeypatch.setenv("PYMONGOIM__STORAGE_ENGINE", "wiredTiger")
+    monkeypatch.setenv("PYMONGOIM__RAM_DISK_FOLDER", str(tmpdir))
+    monkeypatch.setenv("PYMONGOIM__RAM_DISK_MIN_FREE_MB", "0")
+
+    md = Mongod(None)
+    assert os.path.dirname(md.data_folder) == str(tmpdir)
+    md.stop()
+
+    monkeypatch.setenv("PYMONGOIM__RAM_DISK_MIN_FREE_MB", str(2**40))
+    md = Mongod(None)
+    assert os.path.dirname(md.data_folder) != str(tmpdir)
+    md.stop()
+
+    monkeypatch.setenv("PYMONGOIM__RAM_DISK_MIN_FREE_MB", "0")
+    monkeypatch.setenv("PYMONGOIM__STORAGE_ENGINE", "ephemeralForTest")
+    md = Mongod(None)
+    assert os.path.dirname(md.data_folder) != str(tmpdir)
+    md.stop()
+
+    # Replica set members and template builds switch to wiredTiger.
+    md = Mongod(None, on_disk=True)
+    assert md.config.engine == "wiredTiger"
+    assert os.path.dirname(md.data_folder) == str(tmpdir)
+    md.stop()
+
+
+def test_launch_profile(monkeypatch, fake_mongod):
+    monkeypatch.setenv("PYMONGOIM__MONGOD_PROFILE", "production-like")
+    monkeypatch.setenv("PYMONGOIM__MONGOD_EXTRA_ARGS", "--quiet")
+
+    with Mongod(None) as md:
+        assert md.config.engine == "wiredTiger"
+        assert md._proc.cmd[-1] == "--quiet"
+
+
+def test_start_many(monkeypatch, fake_mongod):
+    mongods = mongod.start_many(4)
+    assert all(md.is_running for md in mongods)
+    assert len({md.config.port for md in mongods}) == 4
+    assert set(md._proc for md in mongods) <= set(mongod._registry.running())
+
+    mongod.stop_many(mongods)
+    assert not any(md.is_running for md in mongods)
+
+
+def test_start_many_stops_all_on_failure(monkeypatch, fake_mongod):
+    monkeypatch.setattr(subprocess, "Popen", CrashingPopen)
+
+    with pytest.raises(MongodStartupError):
+        mongod.start_many(2)
+
+
+class CommandEvent:
+    def __init__(self, database_name, command):
+        self.database_name = database_name
+        self.command = command
+        self.command_name = next(iter(command))
+
+
+class ResetClient:
+    def __init__(self):
+        self.calls = []
+
+    def __getitem__(self, name):
+        return Namespace(self, name)
+
+    def close(self):
+        pass
+
+
+class Namespace:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def __getitem__(self, name):
+        return Namespace(self.client, "{}.{}".format(self.name, name))
+
+    def drop_collection(self, name):
+        self.client.calls.append(("drop", "{}.{}".format(self.name, name)))
+
+    def delete_many(self, query):
+        self.client.calls.append(("delete", self.name))
+
+
+def test_write_tracker():
+    tracker = mongod._WriteTracker()
+    for database, command in [
+        ("db", {"insert": "users", "documents": []}),
+        ("db", {"find": "users"}),
+        ("db", {"create": "scratch"}),
+        ("db", {"insert": "scratch", "documents": []}),
+        ("db", {"aggregate": "users", "pipeline": [{"$out": "report"}]}),
+        (
+            "db",
+            {
+                "aggregate": "users",
+                "pipeline": [{"$merge": {"into": {"db": "other", "coll": "totals"}}}],
+            },
+        ),
+        ("admin", {"renameCollection": "db.users", "to": "db.people"}),
+        ("admin", {"bulkWrite": 1, "ops": [], "nsInfo": [{"ns": "db.logs"}]}),
+        ("config", {"insert": "system.sessions", "documents": []}),
+    ]:
+        tracker.started(CommandEvent(database, command))
+
+    written, created = tracker.take()
+    assert written == {
+        ("db", "users"),
+        ("db", "report"),
+        ("other", "totals"),
+        ("db", "logs"),
+    }
+    assert created == {("db", "scratch"), ("db", "people")}
+    assert tracker.take() == (set(), set())
+
+
+def test_reset_drops_only_written_collections(monkeypatch, fake_mongod):
+    with Mongod(None) as md:
+        md._client = ResetClient()
+        md.write_tracker.started(CommandEvent("db", {"create": "scratch"}))
+        md.write_tracker.started(CommandEvent("db", {"insert": "users"}))
+
+        md.reset(keep_indexes=True)
+        assert md._client.calls == [("drop", "db.scratch"), ("delete", "db.users")]
+
+        md._client.calls.clear()
+        md.write_tracker.started(CommandEvent("db", {"update": "users"}))
+        md.reset()
+        assert md._client.calls == [("drop", "db.users")]
+
+
+def test_reset_rolls_back_writes_of_own_client(monkeypatch, fake_mongod):
+    with Mongod(None) as md:
+        # As published by the client for an insert.
+        for listener in md.client.options.event_listeners:
+            listener.started(CommandEvent("db", {"insert": "users"}))
+        md._client = ResetClient()
+
+        md.reset()
+        assert md._client.calls == [("drop", "db.users")]
+
+
+def test_persistent_mongod_is_reused(monkeypatch, fake_mongod, tmpdir):
+    alive = set()
+    spawned = []
+
+    class PersistentPopen(Popen):
+        def __init__(self, cmd, start_new_session=False):
+            super().__init__(cmd)
+            assert start_new_session
+            self.pid = 1000 + len(spawned)
+            spawned.append(self)
+            alive.add(self.pid)
+
+    monkeypatch.setattr(subprocess, "Popen", PersistentPopen)
+    monkeypatch.setattr(mongod, "_pid_alive", lambda pid: pid in alive)
+
+    shutdown_over = []
+
+    def shutdown_adopted(self):
+        shutdown_over.append(self.config.unix_socket)
+        alive.discard(self._adopted_pid)
+        self._adopted_pid = None
+
+    monkeypatch.setattr(Mongod, "_shutdown_adopted", shutdown_adopted)
+    monkeypatch.setenv("PYMONGOIM__PERSISTENT", "True")
+    monkeypatch.setenv("PYMONGOIM__PERSISTENT_FOLDER", str(tmpdir))
+
+    with Mongod(None) as md:
+        port = md.config.port
+        assert md.data_folder == os.path.join(tmpdir, "data")
+    assert not spawned[0].terminated
+
+    with Mongod(None) as md:
+        assert len(spawned) == 1
+        assert md.config.port == port
+        assert md.is_running
+
+    # Another profile doesn't match the running daemon.
+    monkeypatch.setenv("PYMONGOIM__MONGOD_PROFILE", "fast-test")
+    with Mongod(None) as md:
+        assert len(spawned) == 2
+        assert md.is_running
+
+    # Nor does another transport, the old daemon is shut down over its own.
+    monkeypatch.setenv("PYMONGOIM__USE_UNIX_SOCKET", "True")
+    with Mongod(None) as md:
+        assert len(spawned) == 3
+        assert shutdown_over[-1] is None
+        assert "--unixSocketPrefix" in spawned[-1].cmd
+        assert md.config.unix_socket is not None
+
+
+def test_unix_socket(monkeypatch, fake_mongod):
+    monkeypatch.setenv("PYMONGOIM__USE_UNIX_SOCKET", "True")
+
+    with Mongod(None) as md:
+        unix_socket = os.path.join(md.data_folder, "mongod.sock")
+        assert md.config.port is None
+        assert md.connection_string == "mongodb://{}/pimtest".format(
+            unix_socket.replace("/", "%2F")
+        )
+        cmd = md._proc.cmd
+        assert cmd[cmd.index("--bind_ip") + 1] == unix_socket
+        assert cmd[cmd.index("--unixSocketPrefix") + 1] == md.data_folder
+        assert "--port" not in cmd
+
+
+def test_attached_client_is_left_open(monkeypatch, fake_mongod):
+    monkeypatch.setenv("PYMONGOIM__CLIENT_COMPRESSORS", "zlib")
+
+    md = Mongod(None)
+    assert md.client.options.pool_options._compression_settings.compressors == [
+        "zlib"
+    ]
+    client = AdminClient()
+    # Fails the test if stop closes it.
+    client.close = None
+    md.attach_client(client)
+    with md:
+        assert md.client is client
+
+
+def test_auto_size(monkeypatch, fake_mongod):
+    sizing = mongod._sizing.Sizing(None, 64, 1088)
+    computed = []
+
+    def compute(instances, max_cache_gb=None):
+        computed.append((instances, max_cache_gb))
+        return sizing
+
+    monkeypatch.setattr(mongod._sizing, "compute", compute)
+    limits = []
+    monkeypatch.setattr(mongod._sizing, "raise_file_limit", limits.append)
+    monkeypatch.setenv("PYMONGOIM__AUTO_SIZE", "True")
+    monkeypatch.setenv("PYMONGOIM__AUTO_SIZE_INSTANCES", "2")
+    monkeypatch.setenv("PYMONGOIM__MONGOD_PROFILE", "fast-test")
+
+    with Mongod(None) as md:
+        assert md._proc.cmd[md._proc.cmd.index("--maxConns") + 1] == "64"
+    assert limits == [1088]
+    assert computed[-1] == (2, 0.25)
+
+    # Daemons started together share the host evenly, whatever started first.
+    computed.clear()
+    mongods = mongod.start_many(3)
+    mongod.stop_many(mongods)
+    assert {instances for instances, _ in computed} == {3}
+
+
+class StatusClient(AdminClient):
+    def command(self, name, **kwargs):
+        super().command(name, **kwargs)
+        if name == "serverStatus":
+            cache = {
+                "maximum bytes configured": 33554432,
+                "pages read into cache": 1200,
+                "application thread time evicting (usecs)": 5400,
+            }
+            return {"wiredTiger": {"cache": cache}}
+
+
+def test_constrained_profile_reports_cache(monkeypatch, fake_mongod):
+    monkeypatch.setenv("PYMONGOIM__MONGOD_PROFILE", "constrained")
+    monkeypatch.setenv("PYMONGOIM__AUTO_SIZE", "True")
+
+    with Mongod(None) as md:
+        cmd = md._proc.cmd
+        assert cmd[cmd.index("--wiredTigerEngineConfigString") + 1] == "cache_size=32M"
+        assert cmd[cmd.index("--maxConns") + 1] == "32"
+        md._client = StatusClient()
+    assert md.cache_report["max_bytes"] == 33554432
+    assert md.cache_report["pages_read"] == 1200
+    assert md.cache_report["app_thread_eviction_usecs"] == 5400
+    assert md.cache_report["pages_evicted_by_app_threads"] is None
@@ -0,0 +1,170 @@
+import threading
+import time
+
+import pymongo
+import pytest
+
+from pymongo_inmemory import _pim
+
+
+class Mongod:
+    def __init__(self, pim_context):
+        self.connection_string = "mongodb://127.0.0.1:27017/pimtest"
+        self.starts = 0
+        self.stops = []
+
+    @property
+    def is_running(self):
+        return self.starts > len(self.stops)
+
+    def start(self):
+        self.starts += 1
+
+    def stop(self, clean_up=True):
+        self.stops.append(clean_up)
+
+
+def test_lazy_start(monkeypatch):
+    monkeypatch.setattr(_pim, "Mongod", Mongod)
+    monkeypatch.setenv("PYMONGOIM__LAZY_START", "True")
+
+    client = _pim.MongoClient()
+    assert client._mongod.starts == 0
+    client._get_topology()
+    assert client._mongod.starts == 1
+    client._get_topology()
+    assert client._mongod.starts == 1
+    client.close()
+    assert client._mongod.stops == [True]
+
+
+def test_client_is_closed_before_mongod_stops(monkeypatch):
+    monkeypatch.setattr(_pim, "Mongod", Mongod)
+    monkeypatch.setenv("PYMONGOIM__LAZY_START", "True")
+    calls = []
+    close = pymongo.MongoClient.close
+
+    def record_close(self):
+        calls.append("client")
+        close(self)
+
+    monkeypatch.setattr(pymongo.MongoClient, "close", record_close)
+    monkeypatch.setattr(
+        Mongod, "stop", lambda self, clean_up=True: calls.append("mongod")
+    )
+
+    client = _pim.MongoClient()
+    client._get_topology()
+    client.close()
+    assert calls == ["client", "mongod"]
+
+
+def test_idle_timeout_stops_and_restarts(monkeypatch):
+    monkeypatch.setattr(_pim, "Mongod", Mongod)
+    monkeypatch.setenv("PYMONGOIM__LAZY_START", "True")
+    monkeypatch.setenv("PYMONGOIM__IDLE_TIMEOUT", "0.05")
+
+    client = _pim.MongoClient()
+    client._get_topology()
+    deadline = time.monotonic() + 5
+    while client._mongod.is_running and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert client._mongod.stops == [False]
+
+    client._get_topology()
+    assert client._mongod.starts == 2
+    client.close()
+
+
+def test_operation_waits_for_idle_stop(monkeypatch):
+    monkeypatch.setattr(_pim, "Mongod", Mongod)
+    monkeypatch.setenv("PYMONGOIM__LAZY_START", "True")
+
+    client = _pim.MongoClient()
+    client._get_topology()
+    # The idle watcher decided to stop mongod.
+    with client._pim_lock:
+        operation = threading.Thread(target=client._get_topology)
+        operation.start()
+        operation.join(0.05)
+        assert operation.is_alive()
+        client._mongod.stop(clean_up=False)
+    operation.join(5)
+    assert client._mongod.is_running
+    client.close()
+
+
+class Session:
+    def __init__(self):
+        self.in_transaction = False
+        self.aborted = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def start_transaction(self):
+        self.in_transaction = True
+
+    def abort_transaction(self):
+        self.in_transaction = False
+        self.aborted = True
+
+
+def test_isolated_transaction_is_injected_and_aborted(monkeypatch):
+    monkeypatch.setattr(_pim, "ReplicaSet", Mongod)
+    monkeypatch.setenv("PYMONGOIM__LAZY_START", "True")
+    monkeypatch.setenv("PYMONGOIM__REPLICA_SET_MEMBERS", "1")
+    session = Session()
+
+    client = _pim.MongoClient()
+    client.start_session = lambda: session
+    with client.pim_isolated() as isolated:
+        assert isolated is session
+        assert client._ensure_session() is session
+        with client._tmp_session(None) as tmp_session:
+            assert tmp_session is session
+    client.close()
+
+    assert session.aborted
+    assert client._pim_session is None
+
+
+def test_isolated_transaction_needs_replica_set(monkeypatch):
+    monkeypatch.setattr(_pim, "Mongod", Mongod)
+    monkeypatch.setenv("PYMONGOIM__LAZY_START", "True")
+
+    client = _pim.MongoClient()
+    with pytest.raises(RuntimeError):
+        with client.pim_isolated():
+            pass
+    client.close()
+
+
+def test_reset_needs_single_mongod(monkeypatch):
+    monkeypatch.setattr(_pim, "ReplicaSet", Mongod)
+    monkeypatch.setenv("PYMONGOIM__LAZY_START", "True")
+    monkeypatch.setenv("PYMONGOIM__REPLICA_SET_MEMBERS", "1")
+
+    client = _pim.MongoClient()
+    with pytest.raises(RuntimeError):
+        client.pim_reset()
+    client.close()
+
+
+class AttachableMongod(Mongod):
+    def attach_client(self, client):
+        self.client = client
+
+
+def test_client_is_shared_with_mongod(monkeypatch):
+    monkeypatch.setattr(_pim, "Mongod", AttachableMongod)
+    monkeypatch.setenv("PYMONGOIM__LAZY_START", "True")
+    monkeypatch.setenv("PYMONGOIM__CLIENT_POOL_SIZE", "5")
+
+    client = _pim.MongoClient()
+    assert client._mongod.client is client
+    assert client.options.pool_options.max_pool_size == 5
+    client.close()
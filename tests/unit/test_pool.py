@@ -0,0 +1,74 @@
+import queue
+
+import pytest
+
+from pymongo_inmemory import pool
+
+
+class Mongod:
+    fail = False
+    bin_folder = ""
+
+    def __init__(self, pim_context):
+        self.config = self
+        self.started = False
+        self.stopped = False
+
+    def start(self):
+        if self.fail:
+            raise RuntimeError("Can't start")
+        self.started = True
+
+    def stop(self):
+        self.stopped = True
+
+
+class FailingMongod(Mongod):
+    fail = True
+
+
+def test_pool_hands_out_started_instances(monkeypatch):
+    monkeypatch.setattr(pool, "Mongod", Mongod)
+
+    with pool.MongodPool(size=2) as mongod_pool:
+        with mongod_pool.mongod(timeout=5) as md:
+            assert md.started
+        first = mongod_pool.acquire(timeout=5)
+        second = mongod_pool.acquire(timeout=5)
+        assert first is not second
+        mongod_pool.release(first)
+        mongod_pool.release(second)
+
+    assert md.stopped
+    assert first.stopped
+    assert second.stopped
+
+
+def test_pool_stops_idle_instances_on_close(monkeypatch):
+    monkeypatch.setattr(pool, "Mongod", Mongod)
+
+    mongod_pool = pool.MongodPool(size=1)
+    mongod_pool.start()
+    md = mongod_pool.acquire(timeout=5)
+    mongod_pool.release(md)
+    idle = mongod_pool.acquire(timeout=5)
+    mongod_pool._ready.put(idle)
+    mongod_pool.close()
+
+    assert idle.stopped
+    with pytest.raises(queue.Empty):
+        mongod_pool._ready.get_nowait()
+
+
+def test_pool_raises_startup_errors(monkeypatch):
+    monkeypatch.setattr(pool, "Mongod", FailingMongod)
+
+    with pool.MongodPool(size=1) as mongod_pool:
+        with pytest.raises(RuntimeError):
+            mongod_pool.acquire(timeout=5)
+
+
+def test_pool_rejects_fixed_port(monkeypatch):
+    monkeypatch.setenv("PYMONGOIM__MONGOD_PORT", "27017")
+    with pytest.raises(ValueError):
+        pool.MongodPool(size=1)
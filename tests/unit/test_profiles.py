@@ -0,0 +1,51 @@
+import pytest
+
+from pymongo_inmemory import _profiles
+
+
+def test_default_profile_has_no_args():
+    assert _profiles.launch_args("default", "7.0.14", "wiredTiger") == []
+
+
+def test_fast_test_profile():
+    args = _profiles.launch_args("fast-test", "7.0.14", "wiredTiger")
+    assert args[args.index("--wiredTigerCacheSizeGB") + 1] == "0.25"
+    assert "ttlMonitorEnabled=false" in args
+    assert "diagnosticDataCollectionEnabled=false" in args
+
+
+def test_unsupported_flags_are_skipped():
+    args = _profiles.launch_args("fast-test", "3.0.15", "ephemeralForTest")
+    assert "--wiredTigerCacheSizeGB" not in args
+    assert "--wiredTigerJournalCompressor" not in args
+    assert "diagnosticDataCollectionEnabled=false" not in args
+    assert "disableLogicalSessionCacheRefresh=true" not in args
+    assert "ttlMonitorEnabled=false" in args
+
+
+def test_extra_args_override_profile():
+    args = _profiles.launch_args(
+        "fast-test",
+        "7.0.14",
+        "wiredTiger",
+        extra_args="--wiredTigerCacheSizeGB 1 --setParameter ttlMonitorEnabled=true",
+    )
+    assert args.count("--wiredTigerCacheSizeGB") == 1
+    assert args[args.index("--wiredTigerCacheSizeGB") + 1] == "1"
+    assert "ttlMonitorEnabled=false" not in args
+    assert args[-1] == "ttlMonitorEnabled=true"
+
+
+def test_unknown_profile():
+    with pytest.raises(ValueError):
+        _profiles.launch_args("turbo")
+
+
+def test_constrained_profile():
+    args = _profiles.launch_args("constrained", "7.0.14", "wiredTiger")
+    assert args == [
+        "--wiredTigerEngineConfigString",
+        "cache_size=32M",
+        "--maxConns",
+        "32",
+    ]
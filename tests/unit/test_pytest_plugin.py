@@ -0,0 +1,117 @@
+import subprocess
+import sys
+
+from pymongo_inmemory import pytest_plugin
+
+
+class Mongod:
+    startup_duration = 1.5
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+class Reporter:
+    def __init__(self):
+        self.lines = []
+
+    def write_sep(self, sep, title):
+        self.lines.append(title)
+
+    def write_line(self, line):
+        self.lines.append(line)
+
+
+def test_dbnames_are_unique_and_valid():
+    first = pytest_plugin._unique_dbname("tests/test_a.py::test[param/with.dots]")
+    second = pytest_plugin._unique_dbname("tests/test_a.py::test[param/with.dots]")
+
+    assert first != second
+    assert len(first) < 64
+    assert not set('/\\. "$*<>:|?') & set(first)
+
+
+def test_summary_reports_starts_and_teardowns(monkeypatch):
+    timings = pytest_plugin._Timings()
+    monkeypatch.setattr(pytest_plugin, "_timings", timings)
+    reporter = Reporter()
+
+    pytest_plugin.pytest_terminal_summary(reporter)
+    assert reporter.lines == []
+
+    timings.start(Mongod())
+    timings.start(Mongod())
+    timings.stop(Mongod())
+    pytest_plugin.pytest_terminal_summary(reporter)
+
+    assert reporter.lines[0] == "pymongo_inmemory"
+    assert reporter.lines[1] == "2 server starts: 3.00s total, 1.50s max"
+    assert reporter.lines[2].startswith("1 server teardowns: ")
+
+
+class PluginManager:
+    def __init__(self):
+        self.registered = []
+
+    def hasplugin(self, name):
+        return name == "dsession"
+
+    def register(self, plugin, name):
+        self.registered.append(name)
+
+
+class Config:
+    def __init__(self, mode="worker"):
+        self.mode = mode
+        self.pluginmanager = PluginManager()
+
+    def getoption(self, name):
+        return self.mode
+
+    def addinivalue_line(self, name, line):
+        pass
+
+
+class Node:
+    def __init__(self):
+        self.workerinput = {"workerid": "gw0"}
+
+
+def test_controller_hands_out_distinct_ports(monkeypatch):
+    monkeypatch.setenv("PYMONGOIM__USE_LOCAL_MONGOD", "True")
+    controller = pytest_plugin._XdistController(Config())
+    nodes = [Node() for _ in range(4)]
+
+    for node in nodes:
+        controller.pytest_configure_node(node)
+    controller.pytest_sessionfinish()
+
+    assert len({node.workerinput["pim_port"] for node in nodes}) == 4
+    if pytest_plugin._can_pin():
+        assert all("pim_cpu" in node.workerinput for node in nodes)
+
+
+def test_xdist_coordination_is_opt_in(monkeypatch):
+    def fail(*args):
+        raise AssertionError("Controller created")
+
+    monkeypatch.setattr(pytest_plugin, "_XdistController", fail)
+    config = Config(mode=None)
+
+    pytest_plugin.pytest_configure(config)
+
+    assert config.pluginmanager.registered == []
+
+
+def test_loading_plugin_leaves_signal_handlers_alone():
+    # A process of its own, the daemon modules are already imported here.
+    code = (
+        "import signal, sys\n"
+        "import pymongo_inmemory.pytest_plugin\n"
+        "assert 'pymongo_inmemory.mongod' not in sys.modules\n"
+        "assert signal.getsignal(signal.SIGTERM) == signal.SIG_DFL\n"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
@@ -0,0 +1,34 @@
+
+import pytest
+
+from pymongo_inmemory import replset
+
+
+def test_members_boot_with_repl_set(monkeypatch, fake_mongod):
+    monkeypatch.setattr(replset.ReplicaSet, "_initiate", lambda self: None)
+    monkeypatch.setattr(replset.ReplicaSet, "_wait_for_primary", lambda self: None)
+
+    with replset.ReplicaSet(members=3, name="testrs") as rs:
+        assert rs.is_running
+        for md in rs.mongods:
+            assert md.config.engine == "wiredTiger"
+            assert md._proc.cmd[md._proc.cmd.index("--replSet") + 1] == "testrs"
+    assert not rs.is_running
+
+
+def test_initiate_config_and_connection_string():
+    rs = replset.ReplicaSet(members=2, name="testrs")
+    config = rs.initiate_config
+    assert config["_id"] == "testrs"
+    assert [m["host"] for m in config["members"]] == rs.hosts
+    assert config["members"][0]["priority"] > config["members"][1]["priority"]
+    assert rs.connection_string == "mongodb://{}/pimtest?replicaSet=testrs".format(
+        ",".join(rs.hosts)
+    )
+    rs.stop()
+
+
+def test_members_need_own_ports(monkeypatch):
+    monkeypatch.setenv("PYMONGOIM__MONGOD_PORT", "27017")
+    with pytest.raises(ValueError):
+        replset.ReplicaSet(members=2)
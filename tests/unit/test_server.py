@@ -0,0 +1,82 @@
+import os
+import threading
+
+import pytest
+
+from pymongo_inmemory import server
+
+
+class Client:
+    def __init__(self):
+        self.databases = ["admin", "pimlease_leftover"]
+        self.dropped = []
+
+    def list_database_names(self):
+        return self.databases
+
+    def drop_database(self, name):
+        self.dropped.append(name)
+        if name in self.databases:
+            self.databases.remove(name)
+
+
+class Mongod:
+    def __init__(self, pim_context):
+        self.connection_string = "mongodb://127.0.0.1:27017/pimtest"
+        self.client = Client()
+        self.stopped = False
+
+    def start(self):
+        pass
+
+    def stop(self):
+        self.stopped = True
+
+
+@pytest.fixture
+def broker(monkeypatch):
+    monkeypatch.setattr(server, "Mongod", Mongod)
+    broker = server.Broker(lease_ttl=60)
+    broker.start()
+    yield broker
+    broker.stop()
+
+
+def test_lease_database_over_socket(broker, tmpdir):
+    address = os.path.join(tmpdir, "broker.sock")
+    srv = server._make_server(address, broker)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    try:
+        client = server.BrokerClient(address)
+        with client.database(ttl=5) as lease:
+            assert lease.database.startswith(server.LEASE_DATABASE_PREFIX)
+            assert lease.connection_string == broker._mongod.connection_string
+            assert lease.expires_in == 5
+            assert client.renew(lease) == 5
+            assert client.request("status")["leases"] == 1
+        assert broker._mongod.client.dropped == [lease.database]
+
+        with pytest.raises(server.BrokerError):
+            client.release(lease)
+    finally:
+        srv.shutdown()
+        srv.server_close()
+
+
+def test_reclaim_expired_and_leaked_databases(broker):
+    expired = broker.handle({"op": "lease_database", "ttl": 0.001})
+    alive = broker.handle({"op": "lease_database"})
+    broker._mongod.client.databases += [expired["database"], alive["database"]]
+    broker._leases[expired["lease"]].expires_at = 0
+
+    broker.reclaim()
+
+    assert sorted(broker._mongod.client.dropped) == sorted(
+        [expired["database"], "pimlease_leftover"]
+    )
+    assert list(broker._leases) == [alive["lease"]]
+
+
+def test_parse_address():
+    assert server._parse_address("127.0.0.1:27099")[1] == ("127.0.0.1", 27099)
+    assert server._parse_address("/tmp/broker.sock")[1] == "/tmp/broker.sock"
@@ -0,0 +1,55 @@
+import pytest
+
+from pymongo_inmemory import _profiles, _sizing
+
+GB = 1024 ** 3
+
+
+def test_memory_and_connections_are_split_between_instances():
+    assert _sizing.compute(1, memory=9 * GB, cpus=8) == _sizing.Sizing(4.0, 800, 1824)
+    assert _sizing.compute(4, memory=9 * GB, cpus=8) == _sizing.Sizing(1.0, 200, 1224)
+
+
+def test_cache_is_capped():
+    sizing = _sizing.compute(1, memory=9 * GB, cpus=8, max_cache_gb=0.25)
+    assert sizing.cache_gb == 0.25
+
+
+def test_sizing_floors():
+    sizing = _sizing.compute(64, memory=2 * GB, cpus=1)
+    assert sizing.cache_gb == 0.25
+    assert sizing.max_conns == 64
+
+
+def test_unknown_memory_leaves_cache_alone(monkeypatch):
+    monkeypatch.setattr(_sizing, "total_memory", lambda: None)
+    sizing = _sizing.compute(1, cpus=2)
+    assert sizing.cache_gb is None
+    assert [flag.name for flag in _sizing.flags(sizing)] == ["--maxConns"]
+
+
+def test_sizing_overrides_profile():
+    sizing = _sizing.Sizing(1.5, 200, 1224)
+    args = _profiles.launch_args(
+        "fast-test", "7.0.14", "wiredTiger", overrides=_sizing.flags(sizing)
+    )
+    assert args.count("--wiredTigerCacheSizeGB") == 1
+    assert args[args.index("--wiredTigerCacheSizeGB") + 1] == "1.5"
+    assert args[args.index("--maxConns") + 1] == "200"
+
+    args = _profiles.launch_args(
+        "fast-test",
+        "7.0.14",
+        "wiredTiger",
+        extra_args="--maxConns 10",
+        overrides=_sizing.flags(sizing),
+    )
+    assert args.count("--maxConns") == 1
+    assert args[args.index("--maxConns") + 1] == "10"
+
+
+def test_file_limit_is_never_lowered():
+    resource = pytest.importorskip("resource")
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    _sizing.raise_file_limit(1)
+    assert resource.getrlimit(resource.RLIMIT_NOFILE) == (soft, hard)
@@ -0,0 +1,162 @@
+import os
+from os import path
+
+from pymongo_inmemory import context, templates
+
+
+class Mongod:
+    def __init__(self, pim_context, template=None, on_disk=False):
+        self.data_folder = pim_context.template_folder + "-data"
+        self.config = self
+        # Seed writes straight into the data folder of the fake daemon.
+        self.client = self
+        self.connection_string = "mongodb://127.0.0.1:27017/pimtest"
+        self.template = template
+
+    def start(self):
+        os.makedirs(self.data_folder, exist_ok=True)
+
+    def stop(self, clean_up=True):
+        pass
+
+
+def seed(client):
+    seed.calls += 1
+    with open(path.join(client.data_folder, "collection-0.wt"), "w") as f:
+        f.write("seeded")
+
+
+def other_seed(client):
+    pass
+
+
+def test_template_key(monkeypatch, tmpdir):
+    monkeypatch.setenv("PYMONGOIM__TEMPLATE_FOLDER", str(tmpdir))
+    fixture = tmpdir.join("users.json")
+    fixture.write("[]")
+    cache = templates.TemplateCache()
+
+    key = cache.key(seed, [str(fixture)])
+    assert key == cache.key(seed, [str(fixture)])
+    assert key != cache.key(other_seed, [str(fixture)])
+    fixture.write("[{}]")
+    assert key != cache.key(seed, [str(fixture)])
+
+
+def test_template_is_built_once(monkeypatch, tmpdir):
+    monkeypatch.setenv("PYMONGOIM__TEMPLATE_FOLDER", str(tmpdir.mkdir("templates")))
+    monkeypatch.setattr(templates, "Mongod", Mongod)
+    pim_context = context.Context()
+    seed.calls = 0
+
+    cache = templates.TemplateCache(pim_context)
+    template_path = cache.get(seed)
+    assert cache.get(seed) == template_path
+    assert seed.calls == 1
+    assert path.isfile(path.join(template_path, "collection-0.wt"))
+    assert cache.mongod(seed).template == template_path
+
+
+def test_export_and_import(monkeypatch, tmpdir):
+    monkeypatch.setenv("PYMONGOIM__TEMPLATE_FOLDER", str(tmpdir.mkdir("templates")))
+    cache = templates.TemplateCache()
+    os.mkdir(cache.path("abc"))
+    with open(path.join(cache.path("abc"), "collection-0.wt"), "w") as f:
+        f.write("seeded")
+
+    archive = cache.export("abc", str(tmpdir))
+
+    monkeypatch.setenv("PYMONGOIM__TEMPLATE_FOLDER", str(tmpdir.mkdir("imported")))
+    other_cache = templates.TemplateCache()
+    assert other_cache.import_archive(archive) == "abc"
+    assert path.isfile(path.join(other_cache.path("abc"), "collection-0.wt"))
+
+
+class ServerClient:
+    """Records commands sent through databases of the client"""
+
+    def __init__(self, version):
+        self.version = version
+        self.commands = []
+        self.dropped = []
+
+    def __getitem__(self, name):
+        return ServerDatabase(self, name)
+
+    def server_info(self):
+        return {"versionArray": self.version}
+
+    def list_database_names(self):
+        return []
+
+    def drop_database(self, name):
+        self.dropped.append(name)
+
+
+class ServerDatabase:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def __getitem__(self, name):
+        return self
+
+    def command(self, name, value, **kwargs):
+        self.client.commands.append((self.name, name, value, kwargs))
+
+    def list_collections(self):
+        return [
+            {"name": "users", "type": "collection", "options": {}},
+            {"name": "system.profile", "type": "collection", "options": {}},
+            {
+                "name": "adults",
+                "type": "view",
+                "options": {"viewOn": "users", "pipeline": []},
+            },
+        ]
+
+    def list_indexes(self):
+        return [
+            {"v": 2, "key": {"_id": 1}, "name": "_id_"},
+            {"v": 2, "key": {"email": 1}, "name": "email_1", "unique": True},
+        ]
+
+
+def test_template_database_clone():
+    client = ServerClient([7, 0, 2, 0])
+
+    templates.TemplateDatabase(client).clone("test")
+
+    index = {"key": {"email": 1}, "name": "email_1", "unique": True}
+    assert client.dropped == ["test"]
+    assert client.commands == [
+        ("test", "create", "users", {}),
+        ("test", "createIndexes", "users", {"indexes": [index]}),
+        (
+            "pimtemplate",
+            "aggregate",
+            "users",
+            {"pipeline": [{"$out": {"db": "test", "coll": "users"}}], "cursor": {}},
+        ),
+        ("test", "create", "adults", {"viewOn": "users", "pipeline": []}),
+    ]
+
+
+def test_template_database_clone_on_old_servers():
+    client = ServerClient([4, 2, 0, 0])
+
+    templates.TemplateDatabase(client).clone("test")
+
+    staging = "pim_staging.test.users"
+    assert client.commands[2] == (
+        "pimtemplate",
+        "aggregate",
+        "users",
+        {"pipeline": [{"$out": staging}], "cursor": {}},
+    )
+    assert client.commands[3] == (
+        "admin",
+        "renameCollection",
+        "pimtemplate." + staging,
+        {"to": "test.users", "dropTarget": True},
+    )
@@ -0,0 +1,127 @@
+import pytest
+
+from pymongo_inmemory import undo
+
+
+class Cursor(list):
+    def sort(self, key, direction):
+        return Cursor(self if direction > 0 else reversed(self))
+
+    def limit(self, n):
+        return Cursor(self[:n])
+
+
+class Client:
+    """Oplog, pre-images and a log of the calls made to undo them"""
+
+    def __init__(self, oplog, pre_images=()):
+        self.oplog = oplog
+        self.pre_images = list(pre_images)
+        self.calls = []
+
+    def __getitem__(self, name):
+        return Database(self, name)
+
+    def list_database_names(self):
+        return ["admin", "db"]
+
+
+class Database:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def __getitem__(self, name):
+        return Collection(self.client, "{}.{}".format(self.name, name))
+
+    def list_collections(self, filter=None):
+        return [
+            {"name": "users", "options": {}},
+            {"name": "system.views", "options": {}},
+        ]
+
+    def command(self, name, value, **kwargs):
+        self.client.calls.append((name, value))
+
+    def drop_collection(self, name):
+        self.client.calls.append(("drop", "{}.{}".format(self.name, name)))
+
+
+class Collection:
+    def __init__(self, client, namespace):
+        self.client = client
+        self.namespace = namespace
+
+    def find(self, query, projection=None):
+        if "ts" in query:
+            return Cursor(e for e in self.client.oplog if e["ts"] > query["ts"]["$gt"])
+        return Cursor(self.client.oplog)
+
+    def find_one(self, query):
+        for pre_image in self.client.pre_images:
+            if all(pre_image["_id"][k[4:]] == v for k, v in query.items()):
+                return pre_image
+        return None
+
+    def delete_one(self, query):
+        self.client.calls.append(("delete", self.namespace, query["_id"]))
+
+    def replace_one(self, query, document, upsert=False):
+        self.client.calls.append(("replace", self.namespace, document))
+
+    def drop_index(self, name):
+        self.client.calls.append(("dropIndex", self.namespace, name))
+
+
+def pre_image(ts, document, index=0):
+    return {
+        "_id": {"nsUUID": "users-uuid", "ts": ts, "applyOpsIndex": index},
+        "preImage": document,
+    }
+
+
+def test_undo_inverts_entries_newest_first():
+    oplog = [{"ts": 1, "op": "n", "ns": ""}]
+    client = Client(oplog, [pre_image(3, {"_id": 1, "n": 0})])
+    undoer = undo.OplogUndo(client)
+    undoer.mark()
+    assert client.calls == [("collMod", "users")]
+    client.calls.clear()
+
+    oplog += [
+        {"ts": 2, "op": "i", "ns": "db.users", "ui": "users-uuid", "o": {"_id": 1}},
+        {"ts": 3, "op": "u", "ns": "db.users", "ui": "users-uuid", "o": {}},
+        {"ts": 4, "op": "c", "ns": "db.$cmd", "o": {"create": "scratch"}},
+        {"ts": 5, "op": "i", "ns": "db.scratch", "o": {"_id": 2}},
+        {
+            "ts": 6,
+            "op": "c",
+            "ns": "db.$cmd",
+            "o": {"createIndexes": "users", "name": "n_1", "key": {"n": 1}},
+        },
+        {"ts": 7, "op": "i", "ns": "config.system.sessions", "o": {"_id": 3}},
+    ]
+    undoer.undo()
+
+    assert client.calls[:4] == [
+        ("dropIndex", "db.users", "n_1"),
+        ("replace", "db.users", {"_id": 1, "n": 0}),
+        ("delete", "db.users", 1),
+        ("drop", "db.scratch"),
+    ]
+
+
+def test_undo_refuses_uninvertible_entries():
+    oplog = [{"ts": 1, "op": "n", "ns": ""}]
+    client = Client(oplog)
+    undoer = undo.OplogUndo(client)
+    undoer.mark()
+    client.calls.clear()
+
+    oplog += [
+        {"ts": 2, "op": "i", "ns": "db.users", "ui": "users-uuid", "o": {"_id": 1}},
+        {"ts": 3, "op": "c", "ns": "db.$cmd", "o": {"drop": "users"}},
+    ]
+    with pytest.raises(undo.UndoError):
+        undoer.undo()
+    assert client.calls == []
@@ -1,34 +1,36 @@
 import os.path as path
-import socket
+import subprocess
+import sys
+import threading
+import time
 
-from pymongo_inmemory import _utils
-
-
-def test_find_open_port(monkeypatch):
-    open_ports = (123, 125)
+import pytest
 
-    class mock_socket:
-        AF_INET = None
-        SOCK_STREAM = None
+from pymongo_inmemory import _utils
 
-        def __init__(self, *args, **kwargs):
-            pass
 
-        def connect_ex(self, obj):
-            if obj[1] in open_ports:
-                return 0
-            return 42
+def test_reserve_port_holds_port_until_released():
+    first = _utils.reserve_port(range(12330, 12332))
+    second = _utils.reserve_port(range(12330, 12332))
+    try:
+        assert {first.port, second.port} == {12330, 12331}
+        with pytest.raises(RuntimeError):
+            _utils.reserve_port(range(12330, 12332))
+    finally:
+        first.release()
+        second.release()
 
-        def __enter__(self):
-            return self
+    third = _utils.reserve_port(range(12330, 12331))
+    third.release()
+    assert third.port == 12330
 
-        def __exit__(self, *args):
-            pass
 
-    monkeypatch.setattr(socket, "socket", mock_socket)
-    assert _utils.find_open_port([123, 124]) == 124
-    assert _utils.find_open_port([122, 123]) == 122
-    assert _utils.find_open_port([123, 125, 122]) == 122
+def test_reserve_ephemeral_port():
+    reservation = _utils.reserve_port()
+    try:
+        assert reservation.port > 0
+    finally:
+        reservation.release()
 
 
 def test_make_semver():
@@ -67,3 +69,48 @@ def test_make_folder(monkeypatch, tmpdir):
         path.join(tmpdir, "test2", "nested"),
     )
     assert path.exists(path.join(tmpdir, "test2", "nested"))
+
+
+def test_wait_for_exit():
+    proc = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+    try:
+        assert _utils.wait_for_exit(proc, 0.01) is None
+        proc.terminate()
+        started_at = time.monotonic()
+        assert _utils.wait_for_exit(proc, 10) is not None
+        assert time.monotonic() - started_at < 5
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+def test_clone_tree(tmpdir):
+    src = tmpdir.mkdir("src")
+    src.join("data.wt").write("data")
+    src.mkdir("journal").join("WiredTigerLog.1").write("log")
+    src.join("mongod.lock").write("123")
+
+    dst = path.join(tmpdir, "dst")
+    _utils.clone_tree(str(src), dst, ignore=["mongod.lock"])
+    with open(path.join(dst, "data.wt")) as f:
+        assert f.read() == "data"
+    assert path.isfile(path.join(dst, "journal", "WiredTigerLog.1"))
+    assert not path.exists(path.join(dst, "mongod.lock"))
+
+
+def test_file_lock_is_exclusive(tmpdir):
+    lock_path = path.join(tmpdir, ".lock")
+    events = []
+
+    def hold():
+        with _utils.file_lock(lock_path):
+            events.append("second")
+
+    with _utils.file_lock(lock_path):
+        thread = threading.Thread(target=hold)
+        thread.start()
+        time.sleep(0.1)
+        events.append("first")
+    thread.join(5)
+
+    assert events == ["first", "second"]